@@ -2,9 +2,16 @@ from django import forms
 from datastats_variables_xyz import *
 from django.db.models import Min, Max
 from .models import Job
-from io import BytesIO
-import pandas as pd
+import threading
 import boto3
+import time
+import sys
+import os
+
+# Le cache du fichier reg_dep_com.csv est partagé avec la Lambda de nettoyage
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'lambda_functions'))
+
+from city_normalization import RegionReferenceCache
 
 # --------------------------
 # ------ Requêtes SQL ------
@@ -30,12 +37,48 @@ session = boto3.Session()
 s3_client = session.client('s3')
 
 # Récupération des régions et départements avec les cheflieux associés
-response = s3_client.get_object(Bucket=bucket_name, Key=f'{folder_name}/{file_name}')
-df_region = pd.read_csv(BytesIO(response['Body'].read()))
+# Le fichier est gardé en mémoire (RegionReferenceCache, comme dans la Lambda de nettoyage), et revalidé auprès de S3
+# toutes les REG_DEP_COM_TTL secondes par un GetObject conditionnel (If-None-Match) : S3 ne renvoie le fichier que
+# s'il a changé. Sans accès à S3 (tests hors ligne), le fichier local REG_DEP_COM_LOCAL_PATH est utilisé
+region_reference = RegionReferenceCache(s3_client, bucket_name, f'{folder_name}/{file_name}',
+                                        ttl=int(os.environ.get('REG_DEP_COM_TTL', 300)),
+                                        local_path=os.environ.get('REG_DEP_COM_LOCAL_PATH'))
+
+# Listes des formulaires, recalculées seulement quand le fichier change (nouvel ETag)
+region_lists = {'etag': None, 'region_cheflieu': [], 'departement_cheflieu': []}
+
+
+def refresh_region_lists():
+    region_reference.refresh()
+    if region_lists['etag'] != region_reference.etag:
+        df_region = region_reference.frame
+        region_lists['region_cheflieu'] = sorted(list((df_region['region'] + ' | ' + df_region['region_cheflieu']).unique()))
+        region_lists['departement_cheflieu'] = sorted(list((df_region['departement'] + ' | ' + df_region['departement_cheflieu']).unique()))
+        region_lists['etag'] = region_reference.etag
+
+
+# La revalidation est faite par un thread en arrière-plan, jamais pendant une requête : l'affichage d'un formulaire
+# ne lit que les listes en mémoire. En cas d'erreur, les listes précédentes sont gardées jusqu'au passage suivant
+def refresh_region_lists_periodically():
+    while True:
+        time.sleep(region_reference.ttl)
+        try:
+            refresh_region_lists()
+        except Exception:
+            pass
+
+
+refresh_region_lists()
+threading.Thread(target=refresh_region_lists_periodically, daemon=True).start()
+
+
+# Choix des formulaires, évalués à chaque affichage à partir des listes en mémoire
+def region_cheflieu_choices():
+    return [(choice, choice) for choice in region_lists['region_cheflieu']]
 
 
-unique_region_cheflieu = sorted(list((df_region['region'] + ' | ' + df_region['region_cheflieu']).unique()))
-unique_departement_cheflieu = sorted(list((df_region['departement'] + ' | ' + df_region['departement_cheflieu']).unique()))
+def departement_cheflieu_choices():
+    return [(choice, choice) for choice in region_lists['departement_cheflieu']]
 
 # -------------------------
 # ------ Formulaires ------
@@ -139,12 +182,12 @@ class RegionToAddFormOnCsv(forms.Form):
         required=False
     )
     region_and_cheflieu = forms.ChoiceField(
-        choices=[(choice, choice) for choice in unique_region_cheflieu],
+        choices=region_cheflieu_choices,
         required=False,
         widget=forms.Select(attrs={'class': 'form-control'})
     )
     departement_and_cheflieu = forms.ChoiceField(
-        choices=[(choice, choice) for choice in unique_departement_cheflieu],
+        choices=departement_cheflieu_choices,
         required=False,
         widget=forms.Select(attrs={'class': 'form-control'})
     )
@@ -0,0 +1,151 @@
+from botocore.exceptions import BotoCoreError, ClientError
+import numpy as np
+import pandas as pd
+import hashlib
+import time
+import os
+
+
+# ----------------------------------------------------
+# ------ Normalisation des noms de ville (city) ------
+# ----------------------------------------------------
+
+# Les règles de remplacement sont des données (city_rules.csv, déployé avec la Lambda) : ajouter une règle
+# ne demande pas de modifier le code. Elles sont appliquées dans l'ordre de la colonne position, chacune sur le
+# résultat de la précédente, comme l'ancienne chaîne de .replace(...)
+CITY_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'city_rules.csv')
+
+
+# Lecture des règles : liste de (motif, remplacement) dans l'ordre d'application
+def load_city_rules(path=CITY_RULES_PATH):
+    rules = pd.read_csv(path, dtype=str, keep_default_na=False)
+    rules = rules.sort_values('position', key=lambda position: position.astype(int))
+    return list(zip(rules['pattern'], rules['replacement']))
+
+
+# Empreinte du fichier de règles : toute modification invalide les résolutions déjà mémorisées
+def city_rules_version(path=CITY_RULES_PATH):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# Nom de ville à partir de city_name : partie avant la première virgule, puis règles de remplacement
+# Les règles sont appliquées par opérations vectorisées sur les seules valeurs distinctes de la colonne,
+# le résultat est ensuite reporté sur toutes les lignes
+def normalize_cities(city_names, rules):
+    unique_names = pd.Series(city_names.unique())
+
+    cities = unique_names.str.split(',').str[0].str.strip()
+    for pattern, replacement in rules:
+        cities = cities.str.replace(pattern, replacement, regex=False)
+    cities = cities.str.strip()
+
+    return city_names.map(dict(zip(unique_names, cities)))
+
+
+# -------------------------------------------------------
+# ------ Résolution de la région (reg_dep_com.csv) ------
+# -------------------------------------------------------
+
+# Tables de correspondance construites une fois à partir de reg_dep_com.csv, par ordre de priorité :
+# 1. la ville est une commune                 -> région de la commune, la ville est gardée
+# 2. la ville est un département              -> région du département, la ville devient le chef-lieu de région
+# 3. city_name est une appellation manuelle   -> commune et région associées (La Défense, Cergy-Pontoise...)
+# Sinon la ville et la région restent vides, la ville sera ajoutée à city_error
+# Pour chaque clé, la première ligne du fichier avec une valeur renseignée est retenue
+class RegionResolver:
+
+    def __init__(self, df_region):
+        # Suppression des doublons sur les noms de ville manuels (principalement des villages), comme auparavant
+        df_region = df_region[~df_region['manual_city'].duplicated()]
+
+        self.city_region = self.first_values(df_region, 'city', 'region')
+        self.departement_region = self.first_values(df_region, 'departement', 'region')
+        self.region_cheflieu = self.first_values(df_region, 'region', 'region_cheflieu')
+
+        manual = df_region.dropna(subset=['manual_city']).drop_duplicates('manual_city')
+        self.manual_city = dict(zip(manual['manual_city'], zip(manual['city'], manual['region'])))
+
+    @staticmethod
+    def first_values(df_region, key, value):
+        pairs = df_region[[key, value]].dropna().drop_duplicates(key)
+        return dict(zip(pairs[key], pairs[value]))
+
+    # (ville, région) d'une annonce à partir de city_name et de la ville normalisée
+    # Une valeur introuvable est NaN, comme après les fusions d'origine (et non None, écrit 'None' par la mise en forme)
+    def resolve_one(self, city_name, city):
+        if city in self.city_region:
+            return city, self.city_region[city]
+        if city in self.departement_region:
+            region = self.departement_region[city]
+            return self.region_cheflieu.get(region, np.nan), region
+        return self.manual_city.get(city_name, (np.nan, np.nan))
+
+    # Colonnes city et region : chaque city_name distinct est résolu une seule fois, puis reporté sur toutes les lignes
+    def resolve(self, city_names, cities):
+        pairs = pd.DataFrame({'city_name': city_names, 'city': cities}).drop_duplicates('city_name')
+        resolved = {city_name: self.resolve_one(city_name, city) for city_name, city in zip(pairs['city_name'], pairs['city'])}
+
+        results = city_names.map(resolved)
+        return results.str[0], results.str[1]
+
+
+# ----------------------------------------------------------------
+# ------ Cache du fichier de référence reg_dep_com.csv (S3) ------
+# ----------------------------------------------------------------
+
+# Le fichier est gardé en mémoire par le conteneur avec les tables de correspondance qui en dérivent
+# Il est revalidé auprès de S3 au plus toutes les ttl secondes, par un GetObject conditionnel (If-None-Match) :
+# s'il n'a pas changé, S3 répond 304 sans contenu et rien n'est relu
+# Si S3 est inaccessible et qu'aucune version n'est en mémoire, le fichier local local_path est utilisé (tests hors ligne)
+class RegionReferenceCache:
+
+    def __init__(self, s3_client, bucket_name, key, ttl=300, local_path=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.ttl = ttl
+        self.local_path = local_path
+        self.frame = None
+        self.etag = None
+        self.checked_at = None
+        self.region_resolver = None
+
+    def refresh(self):
+        if self.frame is not None and time.monotonic() - self.checked_at < self.ttl:
+            return self
+
+        try:
+            conditions = {'IfNoneMatch': self.etag} if self.etag else {}
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self.key, **conditions)
+            self.load(pd.read_csv(response['Body'], sep=','), response['ETag'])
+        except ClientError as e:
+            # 304 : la version en mémoire est toujours la bonne
+            if e.response['Error']['Code'] not in ('304', 'NotModified'):
+                self.load_local(e)
+        except BotoCoreError as e:
+            self.load_local(e)
+
+        self.checked_at = time.monotonic()
+        return self
+
+    def load(self, frame, etag):
+        self.frame = frame
+        self.etag = etag
+        self.region_resolver = None
+
+    # Repli sur le fichier local, seulement s'il n'y a encore rien en mémoire (sinon on garde la dernière version)
+    def load_local(self, error):
+        if self.frame is not None:
+            return
+        if not self.local_path or not os.path.exists(self.local_path):
+            raise error
+        with open(self.local_path, 'rb') as f:
+            etag = f'local-{hashlib.sha1(f.read()).hexdigest()}'
+        self.load(pd.read_csv(self.local_path, sep=','), etag)
+
+    # Tables de correspondance construites une seule fois par version du fichier
+    def resolver(self):
+        if self.region_resolver is None:
+            self.region_resolver = RegionResolver(self.frame)
+        return self.region_resolver
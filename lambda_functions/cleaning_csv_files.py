@@ -1,13 +1,20 @@
 import numpy as np
 import pandas as pd
 import psycopg2
-import ast
+from psycopg2.extras import execute_values
+import hashlib
+import io
 import json
 import os
 from datetime import date
 import botocore
 import boto3
 
+from city_normalization import RegionReferenceCache, city_rules_version, load_city_rules, normalize_cities
+from maintenance_lock import MaintenanceLockTimeout, acquire_maintenance_lock, release_maintenance_lock
+from techno_counters import add_techno_counts
+from techno_dictionary import load_dictionary, sync_dictionary
+
 
 # Client AWS
 s3 = boto3.client(
@@ -51,6 +58,115 @@ def get_secret():
 
 database, user, password_db, host, port = get_secret()
 
+# Règles de normalisation des villes, lues une fois par conteneur
+city_rules = load_city_rules()
+city_rules_hash = city_rules_version()
+
+# Fichier reg_dep_com.csv gardé en mémoire par le conteneur (un cache par bucket), revalidé auprès de S3 après le TTL
+region_references = {}
+
+
+# Remplace les appellations par le nom complet puis supprime les doublons, sur toute la colonne en une passe
+# (même logique que python_scripts/techno_matching.py)
+def canonicalize_technos(technos, alias_map):
+    if len(technos) == 0:
+        return technos
+
+    exploded = technos.reset_index(drop=True).str.split(', ').explode()
+    lookup = {techno: alias_map.get(techno, techno) for techno in exploded.unique()}
+
+    frame = pd.DataFrame({'row': exploded.index, 'techno': exploded.map(lookup).values})
+    frame = frame.drop_duplicates()
+    joined = frame.groupby('row', sort=True)['techno'].agg(', '.join)
+
+    return pd.Series(joined.values, index=technos.index, name=technos.name)
+
+
+# Copie d'un DataFrame dans une table via COPY ... FROM STDIN : toutes les lignes partent en un seul envoi
+# Les valeurs manquantes sont écrites \N pour rester distinctes des chaînes vides (NULL comme avec executemany)
+def copy_dataframe(cursor, table_name, dataframe):
+    buffer = io.StringIO()
+    dataframe.to_csv(buffer, index=False, header=False, na_rep='\\N')
+    buffer.seek(0)
+
+    columns = ', '.join(f'"{col}"' for col in dataframe.columns)
+    cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+
+# Résolutions de villes mémorisées {city_name : (city, region)}, table city_resolution et copie en mémoire
+# La version combine l'empreinte des règles de normalisation et l'ETag de reg_dep_com.csv : si l'un des deux change,
+# les villes sont résolues de nouveau. Les villes non résolues sont aussi mémorisées (region vide)
+# Table créée par python_scripts/schema_migration.py, anciennes versions supprimées par python_scripts/city_error.py
+city_memo_cache = {}
+
+
+def load_city_memo(cursor, version):
+    if version not in city_memo_cache:
+        cursor.execute("SELECT city_name, city, region FROM city_resolution WHERE version = %s", (version,))
+        city_memo_cache.clear()
+        city_memo_cache[version] = {city_name: (city, region) for city_name, city, region in cursor.fetchall()}
+    return city_memo_cache[version]
+
+
+# Enregistrement des nouvelles résolutions (validé avec la transaction en cours)
+def save_city_memo(cursor, version, new_entries):
+    execute_values(cursor, """
+        INSERT INTO city_resolution (city_name, version, city, region)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+    """, [(city_name, version, city, region) for city_name, (city, region) in new_entries.items()])
+    city_memo_cache[version].update(new_entries)
+
+
+# Schéma du fichier de scraping : seules ces colonnes sont lues (moteur pyarrow), avec un type explicite
+# Les colonnes à peu de valeurs distinctes sont catégorielles : chaque valeur n'est stockée et transformée qu'une fois
+# Les salaires sont lus en décimal (type des colonnes dans la base), qu'il manque des valeurs ou non
+SCRAP_TEXT_COLUMNS = ['date_of_search', 'job_name', 'company_name', 'city_name', 'technos', 'description']
+SCRAP_CATEGORY_COLUMNS = ['day_of_week', 'job_search', 'job_type', 'sector']
+SCRAP_COLUMNS = SCRAP_TEXT_COLUMNS + SCRAP_CATEGORY_COLUMNS + ['scrap_number', 'lower_salary', 'upper_salary']
+SCRAP_DTYPES = {**{col: 'string[pyarrow]' for col in SCRAP_TEXT_COLUMNS},
+                **{col: 'category' for col in SCRAP_CATEGORY_COLUMNS},
+                'scrap_number': 'Int64',
+                'lower_salary': 'float64',
+                'upper_salary': 'float64'}
+
+# Intitulés de recherche regroupés sous un même métier
+JOB_SEARCH_ALIASES = {'analyste de données': 'data analyst',
+                      'consultant data': 'data analyst',
+                      'ingénieur data': 'data engineer',
+                      'ingénieur de données': 'data engineer',
+                      'data ingénieur': 'data engineer',
+                      'machine learning engineer': 'ml engineer',
+                      'architecte data': 'data architect',
+                      'manager data': 'data manager',
+                      'consultant bi': 'data analyst',
+                      'analyste bi': 'data analyst',
+                      'analysis engineer': 'analytics engineer',
+                      'ingénieur machine learning': 'ml engineer'}
+
+
+def read_scrap_file(body):
+    return pd.read_csv(io.BytesIO(body.read()), sep=',', engine='pyarrow', usecols=SCRAP_COLUMNS, dtype=SCRAP_DTYPES)
+
+
+# Transformation d'une colonne catégorielle : transform est appliquée une fois par catégorie, puis les codes sont
+# reportés sur les lignes. Les valeurs manquantes sont traitées comme 'nan' (même résultat qu'avec astype(str))
+def map_categories(series, transform):
+    values = [transform(category) for category in series.cat.categories] + [transform('nan')]
+    categories, category_codes = np.unique(np.array(values, dtype=object), return_inverse=True)
+
+    # Le code -1 des valeurs manquantes désigne le dernier élément, transform('nan')
+    codes = category_codes[series.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=series.index, name=series.name)
+
+
+# Doublons à l'intérieur d'un fichier : même clé que l'index jobs_month_dedup (intitulé, entreprise, ville, mois),
+# sur les valeurs telles qu'elles seront écrites dans jobs. Retourne le masque des lignes à garder (première occurrence)
+def first_in_batch(df):
+    keys = pd.DataFrame({col: df[col].astype(str).str.strip().str.capitalize() for col in ['job_name', 'company_name', 'city_name']})
+    keys['month'] = pd.to_datetime(df['date_of_search']).dt.to_period('M')
+    return ~keys.duplicated(keep='first')
+
 
 # Fonction Lambda
 def lambda_handler(event, context):
@@ -65,67 +181,53 @@ def lambda_handler(event, context):
             host=host, 
             port=port)
 
+        # On attend la fin d'une éventuelle maintenance (database_cleaning, city_error) avant d'écrire
+        acquire_maintenance_lock(conn, timeout=int(os.environ.get('MAINTENANCE_LOCK_TIMEOUT', 300)))
+
         s3_event = event['Records'][0]['s3']
         bucket_name = s3_event['bucket']['name']
         file_name = s3_event['object']['key']
     
         response = s3.get_object(Bucket=bucket_name, Key=file_name)
-        df = pd.read_csv(response['Body'], sep=',')
+        df = read_scrap_file(response['Body'])
 
         # On ne souhaite pas de valeurs vides dans technos, on ne garde donc pas ces annonces. 
         df = df.dropna(subset=['technos'])
- 
-        df['job_type'] = df['job_type'].apply(lambda x: x.strip().replace('Contrat', 'Temps plein'))
-        df['job_search'] = df['job_search'].replace('analyste de données', 'data analyst')\
-                                        .replace('consultant data', 'data analyst')\
-                                        .replace('ingénieur data', 'data engineer')\
-                                        .replace('ingénieur de données', 'data engineer')\
-                                        .replace('data ingénieur', 'data engineer')\
-                                        .replace('machine learning engineer', 'ml engineer')\
-                                        .replace('architecte data', 'data architect')\
-                                        .replace('manager data', 'data manager')\
-                                        .replace('consultant bi', 'data analyst')\
-                                        .replace('analyste bi', 'data analyst')\
-                                        .replace('analysis engineer', 'analytics engineer')\
-                                        .replace('ingénieur machine learning', 'ml engineer')
-        
-        # On s'assure que chaque élément est en str, et qu'il n'y ait pas d'espaces avant et après
-        for col in df.columns[1:]:
-            if col in ['scrap_number', 'lower_salary', 'upper_salary']:
-                pass
-            else:
-                df[col] = df[col].astype(str).apply(lambda x: x.strip())
+
+        # On s'assure qu'il n'y ait pas d'espaces avant et après (les valeurs manquantes deviennent 'nan' comme auparavant)
+        # Les colonnes catégorielles sont traitées une fois par valeur distincte
+        for col in SCRAP_TEXT_COLUMNS:
+            df[col] = df[col].fillna('nan').str.strip()
+
+        df['job_type'] = map_categories(df['job_type'], lambda x: x.strip().replace('Contrat', 'Temps plein').strip())
+        df['job_search'] = map_categories(df['job_search'], lambda x: JOB_SEARCH_ALIASES.get(x, x).strip())
+        df['day_of_week'] = map_categories(df['day_of_week'], str.strip)
+        df['sector'] = map_categories(df['sector'], str.strip)
 
         # On retire les /n   
-        df['description'] = df['description'].apply(lambda x: x.replace('\n', ''))
-
-        # On créé la colonne avec le nom de ville + traitement des valeurs KO
-        df['city'] = df['city_name'].apply(lambda x: x.split(',')[0]
-                                        .strip()
-                                        .replace('greater', '')
-                                        .replace('metropolitan', '')
-                                        .replace('area', '')
-                                        .replace('region', '')
-                                        .replace(', france', '')
-                                        .replace(' et périphérie', '')
-                                        .replace('ville de', '')
-                                        .replace('île-de-france', 'paris')
-                                        .replace('france', 'paris')
-                                        .replace('la défense', 'puteaux')
-                                        .strip())
-
-        # Création d'une colonne d'index temporaire pour éviter les pertes lors des merge à venir
-        index = pd.Index(range(len(df)))
-        df['index'] = list(index)
-
-        # Récupérer le fichier CSV spécifié
-        region_file_path = "data-files/reg_dep_com.csv"
-        region_file_response = s3.get_object(Bucket=bucket_name, Key=region_file_path)
-        df_region = pd.read_csv(region_file_response['Body'], sep=',')
+        df['description'] = df['description'].str.replace('\n', '', regex=False)
+
+        # Une même annonce revient souvent pour plusieurs recherches : on ne garde que sa première occurrence
+        # avant tout traitement et tout accès à la base
+        batch_size = len(df)
+        df = df[first_in_batch(df)]
+        batch_duplicate_rate = (batch_size - len(df)) / batch_size if batch_size else 0
 
-        # suppression des doublons sur les noms de ville (principalement des villages)
-        df_region = df_region[~df_region['manual_city'].duplicated()]
-        df = df.merge(df_region, on='city', how='left').drop(columns=['region_cheflieu', 'departement', 'departement_cheflieu', 'manual_city'])
+        # Récupérer le fichier CSV spécifié : un conteneur réutilisé le garde en mémoire, S3 n'est interrogé qu'après le TTL
+        # et ne renvoie le fichier que s'il a changé
+        region_file_path = "data-files/reg_dep_com.csv"
+        if bucket_name not in region_references:
+            region_references[bucket_name] = RegionReferenceCache(s3, bucket_name, region_file_path,
+                                                                  ttl=int(os.environ.get('REG_DEP_COM_TTL', 300)),
+                                                                  local_path=os.environ.get('REG_DEP_COM_LOCAL_PATH'))
+        region_reference = region_references[bucket_name].refresh()
+        city_version = hashlib.sha1(f'{city_rules_hash}:{region_reference.etag}'.encode('utf-8')).hexdigest()
+
+        # Villes déjà résolues (mémoire du conteneur, chargée depuis city_resolution au premier passage)
+        cursor = conn.cursor()
+        city_memo = load_city_memo(cursor, city_version)
+        conn.commit()
+        new_city_names = pd.Series(df.loc[~df['city_name'].isin(city_memo.keys()), 'city_name'].unique(), dtype=object)
 
 
         # --------------------------------
@@ -134,87 +236,50 @@ def lambda_handler(event, context):
 
         # Il peut y avoir des valeurs vides dans la région
         # L'entreprise peut mettre juste un département ou une région dans le nom de ville. 
-        # Il faut donc réaliser 3 vérifications : 
-        # Si le nom de ville est juste un département -> On corrige (par chef lieu du département)
-        # Si le nom de ville est juste une région -> On corrige (par chef lieu de la région)
+        # Il faut donc réaliser plusieurs vérifications, dans cet ordre : 
+        # Si le nom de ville est une commune -> On garde la ville et sa région
+        # Si le nom de ville est juste un département -> On corrige (par chef lieu de la région)
+        # Si le nom de ville est un nom particulier (La Défense, Cergy-Pontoise) -> On prend la ville associée
         # Si le nom de ville ne match avec rien -> On ajoute la valeur dans une table pour traitement manuel
+        # Les vérifications sont faites une seule fois par nom de ville distinct, par recherche dans des dictionnaires
+        # et seulement pour les noms de ville jamais rencontrés avec cette version des règles
 
         # --------------------------------
         # --------- FIN CONTEXTE ---------
         # --------------------------------        
 
-        # On vérifie d'abord s'il s'agit de département
-        if len(df[ df['region'].isna() ]) > 0:
-
-            # Séparation des dataframes selon les valeurs vides
-            df_full_1 = df[ ~df['region'].isna() ]
-            df_empty_1 = df[ df['region'].isna() ]
-
-            # Si la ville permet de récupérer la région, il faudra refaire la colonne city
-            # à partir de la colonne région nouvellement remplie
-
-            # On fait le dataframe nécessaire pour la jointure et on supprime les doublons
-            df_departement = df_region[['departement', 'region']].drop_duplicates()
-
-            # Réalisation de la jointure
-            df_empty_1 = df_empty_1.merge(df_departement, left_on='city', right_on='departement', how='left').drop(columns=['region_x']).rename(columns={'region_y': 'region'})
-
-            # On va maintenant refaire la colonne city 
-            # On a besoin que de la région et du chef lieu associé
-            df_region_cheflieu = df_region[['region', 'region_cheflieu']].drop_duplicates()
-
-            df_empty_1 = df_empty_1.merge(df_region_cheflieu, on='region', how='left').drop(columns='city').rename(columns={'region_cheflieu': 'city'})[['date_of_search', 'scrap_number', 'day_of_week', 'job_search', 'job_name', 'company_name', 'city_name', 'city', 'region', 'technos', 'description', 'lower_salary', 'upper_salary', 'job_type', 'sector']]
-
-            # On doit maintenant concaténer les 2 dataframes et récupérer de nouveau ce qui est vide
-            df = pd.concat([df_full_1, df_empty_1], ignore_index = True)
-
-            # Vérification par région
-            if len(df[ df['region'].isna() ]) > 0:
-
-                # Séparation des dataframes selon les valeurs vides
-                df_full_2 = df[ ~df['region'].isna() ]
-                df_empty_2= df[ df['region'].isna() ]
-
-                # Il faut maintenant vérifier que ce n'est pas la région qui est à la place de la ville
-                df_region_2 = df_region[['region', 'region_cheflieu']].drop_duplicates().rename(columns={'region_cheflieu': 'city'})
-
-                df = pd.concat([df_full_2, df_empty_2], ignore_index = True)
-
-                # S'il reste des valeurs vides, alors c'est peut-être un nom de ville particulier
-                # Comme La Défense ou Cergy-Pontoise, on rentre dans le traitement manuel
-                if len(df[ df['region'].isna() ]) > 0:
+        values_to_add_manually = []
+        if len(new_city_names) > 0:
+            # On créé le nom de ville + traitement des valeurs KO (règles de city_rules.csv), puis on cherche la région
+            region_resolver = region_reference.resolver()
+            new_cities, new_regions = region_resolver.resolve(new_city_names, normalize_cities(new_city_names, city_rules))
+            new_entries = {city_name: (None if pd.isna(city) else city, None if pd.isna(region) else region)
+                           for city_name, city, region in zip(new_city_names, new_cities, new_regions)}
+            save_city_memo(cursor, city_version, new_entries)
+            conn.commit()
 
-                    # Séparation des dataframes selon les valeurs vides
-                    df_full_3 = df[ ~df['region'].isna() ]
-                    df_empty_3= df[ df['region'].isna() ]
+            # Seules les nouvelles villes sans région partent en traitement manuel
+            values_to_add_manually = [city_name for city_name, (city, region) in new_entries.items() if region is None]
 
-                    # Il faut maintenant vérifier que ce n'est pas la région qui est à la place de la ville
-                    # Il faut maintenant vérifier que ce n'est pas la région qui est à la place de la ville
-                    df_manual_city = df_region[['manual_city', 'city', 'region']].drop_duplicates()
-                    df_empty_3 = df_empty_3.drop(columns=['city', 'region']).merge(df_manual_city, left_on='city_name', right_on='manual_city', how='left')[['date_of_search', 'scrap_number', 'day_of_week', 'job_search', 'job_name', 'company_name', 'city_name', 'city', 'region', 'technos', 'description', 'lower_salary', 'upper_salary', 'job_type', 'sector']]
-                    
-                    df = pd.concat([df_full_3, df_empty_3], ignore_index = True)
+        # Les villes non résolues sont mémorisées NULL (None) : elles redeviennent NaN pour être écrites NULL dans jobs
+        resolutions = df['city_name'].map(city_memo)
+        city, region = resolutions.str[0], resolutions.str[1]
+        df['city'], df['region'] = city.where(city.notna(), np.nan), region.where(region.notna(), np.nan)
+        cursor.close()
 
-        # On peut maintenant supprimer l'index temporaire
-        df = df.drop(columns='index')[['date_of_search', 'scrap_number', 'day_of_week', 'job_search', 'job_name', 'company_name', 'city_name', 'city', 'region', 'technos', 'description', 'lower_salary', 'upper_salary', 'job_type', 'sector']]
+        df = df[['date_of_search', 'scrap_number', 'day_of_week', 'job_search', 'job_name', 'company_name', 'city_name', 'city', 'region', 'technos', 'description', 'lower_salary', 'upper_salary', 'job_type', 'sector']]
 
-        # S'il reste des valeurs NULL dans la colonne région, il faudra les traiter manuellement
+        # Les nouvelles villes sans région devront être traitées manuellement
         # Elles seront ajoutées à une table, un script python vérifiera plus tard et enverra un mail s'il y a des valeurs
-        if len(df[ df['region'].isna() ]) > 0:
-            
-            # Définition des valeurs à ajouter
-            # Set pour supprimer les doublons, transformés en liste s'il y a plusieurs valeurs
-            values_to_add_manually = list(set(df['city_name'][ df['region'].isna() ]))
+        # Les villes déjà mémorisées sans région y ont été ajoutées lors de leur première apparition
+        if len(values_to_add_manually) > 0:
 
             state_error_city = 'to process'
 
-            # Définition de la requête
-            error_city_query = "INSERT INTO city_error (value, status) VALUES (%s, %s)"  
-            # Liste de tuples pour la mise à jour de la table
-            error_data_to_insert = [(city, state_error_city) for city in values_to_add_manually]
-            # Exécute la requête avec les valeurs de la liste
+            # Copie de toutes les villes en une fois
+            error_data_to_insert = pd.DataFrame({'value': values_to_add_manually, 'status': state_error_city})
             cur = conn.cursor()
-            cur.executemany(error_city_query, error_data_to_insert)
+            copy_dataframe(cur, 'city_error', error_data_to_insert)
             conn.commit()
             cur.close()
 
@@ -222,52 +287,37 @@ def lambda_handler(event, context):
         # ----------- CONTEXTE -----------
         # --------------------------------
 
-        # Les valeurs de salaire arrivent en float dans le dataframe car il y a des NaN
+        # Les valeurs de salaire sont lues en float (il peut y avoir des NaN)
         # Il faut pouvoir garder des NULL en sortie, soit None
         # Certains salaires annuels sont indiqué avec 2 valeurs numériques (60 pour 60K)
-        # Il faut donc remplir les NaN par des 0, pour convertir en INT puis en STR
-        # Seulement après, on peut traiter selon la longueur de la string, puis remettre des None
+        # Il faut donc remplir les NaN par des 0, multiplier les entiers à 2 chiffres, puis écrire en STR sans décimale
+        # Seulement après, on peut remettre des None
 
         # --------------------------------
         # --------- FIN CONTEXTE ---------
         # -------------------------------- 
 
-        df['upper_salary'] = df['upper_salary'].astype(str).replace('nan', '0').apply(lambda x: str(int(x) * 1000) if len(x) == 2 else x).apply(lambda x: None if x == '0' else x)
-        df['lower_salary'] = df['lower_salary'].astype(str).replace('nan', '0').apply(lambda x: str(int(x) * 1000) if len(x) == 2 else x).apply(lambda x: None if x == '0' else x)
+        for col in ['upper_salary', 'lower_salary']:
+            salary = df[col].fillna(0)
+            salary = salary.where(~((salary % 1 == 0) & salary.between(10, 99)), salary * 1000)
+            df[col] = salary.apply(lambda x: None if x == 0 else str(int(x)) if x.is_integer() else str(x))
 
         # On doit garder un seul nom de technos car elles sont indiquées sous différentes appellations. Ces étapes
         # Permettent de garder un nom unique de techno, puis d'écrire le nom sous sa forme correcte
 
         # Ajout des données à la table
         cursor = conn.cursor()
-        cursor.execute("""
-        SELECT values
-        FROM lists
-        WHERE list = 'clean_list'
-                        """)
 
-        # 1. Liste des technos sous forme de dictionnaire : {nom complet : [appellations]}
-        techno_dict = ast.literal_eval(cursor.fetchall()[0][0].replace('\n', ''))
+        # 1. Table de correspondance {appellation : nom complet} du dictionnaire des technos (table techno_alias)
+        # La table lists est réimportée si elle a changé, puis le dictionnaire n'est relu que si sa version a changé :
+        # un conteneur réutilisé le garde en mémoire entre deux invocations
+        sync_dictionary(conn, cursor)
+        alias_map = load_dictionary(cursor).alias_map
+        conn.commit()
         cursor.close()
 
-        # 2. Création de la fonction qui remplace les appellations par le nom complet
-        def replace_technos(row):
-            technos_list = row.split(', ')
-            for index, techno in enumerate(technos_list):
-                for key, value in techno_dict.items():
-                    if techno in value:
-                        technos_list[index] = key
-            return (', ').join(technos_list)
-
-        df['technos'] = df['technos'].apply(replace_technos)
-       
-        # 3. Cette fonction va créer des duplicates, il faut donc les retirer
-        def remove_duplicates(row):
-            technos_list = row.split(', ')
-            unique_technos = list(set(technos_list))
-            return ', '.join(unique_technos)
-
-        df['technos'] = df['technos'].apply(remove_duplicates)
+        # 2. Remplacement des appellations par le nom complet et suppression des doublons créés, en une passe
+        df['technos'] = canonicalize_technos(df['technos'], alias_map)
          
         # Remise en forme des colonnes 
         df = df[['date_of_search', 'scrap_number', 'day_of_week', 'job_search', 'job_name', 'company_name', 'city_name', 'city', 'region', 'technos', 'description', 'lower_salary', 'upper_salary', 'job_type', 'sector']]
@@ -295,9 +345,6 @@ def lambda_handler(event, context):
         # Nom de la table à mettre à jour
         table_name = 'jobs'
 
-        # Conversion du dataframe en liste de tuples
-        data_tuples = [tuple(row) for row in df.itertuples(index=False)]
-
         # Récupération de la date pour supprimer les métiers doublons
         date_of_search = df['date_of_search'].max()        
 
@@ -306,73 +353,60 @@ def lambda_handler(event, context):
         # ----------- CONTEXTE -----------
         # --------------------------------
 
-        # La requête ci-dessous est en deux étapes : 
-        # 1. Insertion des données du jour
-        # 2. Suppression des doublons, une entreprise a le droit à 
+        # Une entreprise a le droit à : 
         #    - Une offre d'emploi par mois
         #    - Par ville
         #    - Par intitulé
-        # On garde pour chaque mois la première occurrence via l'ID
+        # On garde pour chaque mois la première occurrence : l'index unique jobs_month_dedup écarte les suivantes
+        # à l'insertion, le coût dépend du nombre d'annonces du fichier et non plus du volume du mois
 
         # --------------------------------
         # --------- FIN CONTEXTE ---------
         # -------------------------------- 
 
 
-        # Création de la requête d'insertion et de suppression des doublons
+        # Création de la requête d'insertion
+        # Les annonces sont copiées dans une table temporaire (non journalisée, propre à la connexion), puis insérées
+        # dans jobs en une requête, dans l'ordre du fichier : en cas de doublon dans le fichier, la première est gardée
         columns = ', '.join(f'"{col}"' for col in df.columns)
-        placeholders = ', '.join(['%s'] * len(df.columns))
-        insert_query = f'INSERT INTO {table_name} ({columns}) VALUES ({placeholders})'
-        delete_query = f''' 
-            DELETE FROM {table_name}
-            WHERE DATE_TRUNC('month', date_of_search) = DATE_TRUNC('month', DATE('{date_of_search}'))
-            AND id NOT IN (
-                SELECT MIN(id)
-                FROM {table_name}
-                WHERE DATE_TRUNC('month', date_of_search) = DATE_TRUNC('month', DATE('{date_of_search}'))
-                GROUP BY job_name, company_name, city_name, EXTRACT(MONTH FROM date_of_search))
+        staging_query = f'''
+            CREATE TEMP TABLE jobs_staging ON COMMIT DROP AS
+            SELECT {columns}, 0 AS staging_order
+            FROM {table_name}
+            WITH NO DATA
+        '''
+        # Les colonnes utiles au comptage des occurrences sont retournées pour les seules annonces acceptées
+        insert_query = f'''
+            INSERT INTO {table_name} ({columns})
+            SELECT {columns} FROM jobs_staging ORDER BY staging_order
+            ON CONFLICT DO NOTHING
+            RETURNING id, date_of_search, day_of_week, region, job_search, technos
         '''
 
-        # Exécution de la requête pour chaque ligne du dataframe
+        # Chargement du fichier en un seul COPY puis insertion dans jobs, les doublons sont comptés
         with conn.cursor() as cursor:
-            cursor.executemany(insert_query, data_tuples)
-            conn.commit()
-            cursor.execute(delete_query)
+            cursor.execute(staging_query)
+            copy_dataframe(cursor, 'jobs_staging', df.assign(staging_order=range(len(df))))
+            cursor.execute(insert_query)
+            data_du_jour_df = pd.DataFrame(cursor.fetchall(), columns=['id', 'date_of_search', 'day_of_week', 'region', 'job_search', 'technos'])
+            # Annonces écartées car déjà présentes ce mois-ci (même entreprise, intitulé et ville)
+            duplicate_jobs = len(df) - len(data_du_jour_df)
             conn.commit()
 
         # Vérification du scrap en cours 
         if df['scrap_number'].astype(int).max() > 1:
-            first_scrap = False
             scrap_number = df['scrap_number'].astype(int).max()
         else:
-            first_scrap = True
             scrap_number = 1        
-            
-        query = f"SELECT * FROM {table_name} WHERE date_of_search = '{date_of_search}' AND scrap_number = {scrap_number}"
-        
+
+        # Nombre d'annonces du scrap en cours pour la journée (comptage seul, sans relire les annonces)
         cursor = conn.cursor()
-        cursor.execute(query)
-        data_du_jour_df = cursor.fetchall()
-
-        # On transforme les données en DataFrame
-        data_du_jour_df = pd.DataFrame(data_du_jour_df, columns=['id',
-                                                                'date_of_search',
-                                                                'scrap_number',
-                                                                'day_of_week',
-                                                                'job_search',
-                                                                'job_name',
-                                                                'company_name',
-                                                                'city_name',
-                                                                'city',
-                                                                'region',
-                                                                'technos',
-                                                                'description',
-                                                                'lower_salary', 
-                                                                'upper_salary', 
-                                                                'job_type', 
-                                                                'sector'])
-                                                                
-        daily_job_scrap = len(data_du_jour_df)
+        cursor.execute(f"SELECT COUNT(*) FROM {table_name} WHERE date_of_search = %s AND scrap_number = %s", (date_of_search, int(scrap_number)))
+        daily_job_scrap = cursor.fetchone()[0]
+        cursor.close()
+
+        # Les occurrences sont comptées sur les annonces du fichier acceptées par la base (hors doublons du mois) :
+        # les scraps précédents sont déjà dans jobsoccurrences, l'upsert ci-dessous y ajoute ce fichier
 
         # Transformation des technos en liste de mots en retirant les espaces avant et après
         data_du_jour_df['technos'] = data_du_jour_df['technos'].str.split(',').apply(lambda x: [s.strip() for s in x])
@@ -380,6 +414,9 @@ def lambda_handler(event, context):
         # Explode sur les technos afin de faire 1 ligne par technos
         data_du_jour_df = data_du_jour_df.explode('technos')
 
+        # Nombre d'annonces acceptées citant chaque techno, pour l'incrément des compteurs (techno_count)
+        techno_job_counts = data_du_jour_df.drop_duplicates(['id', 'technos'])['technos'].value_counts()
+
         # Création de la colonne occurrences afin de faire une somme avec groupby ensuite
         data_du_jour_df['occurrences'] = 1
 
@@ -392,9 +429,9 @@ def lambda_handler(event, context):
         # ----------- CONTEXTE -----------
         # --------------------------------
 
-        # Récupération des données précédentes si on a un scrap supérieur au numéro 1 
-        # Permet de récupérer ce qui existe dans jobsoccurrences
-        # Le concaténer à ce qu'on va ajouter, mais avant on supprime les données du jour pour éviter les doublons
+        # Les occurrences du scrap s'ajoutent à celles déjà enregistrées pour la journée (scraps précédents)
+        # Une seule requête : les lignes existantes sont incrémentées, les nouvelles insérées
+        # L'addition est faite par la base, deux scraps terminés en même temps ne peuvent pas s'écraser
         # Cela permet d'avoir en fin de journée la somme des technos du jour, par région et métier.
         # Pour l'ensemble des jobs scrapés de la journée, sans prise en compte de doublons. 
 
@@ -405,26 +442,21 @@ def lambda_handler(event, context):
 
         nouvelle_table = 'jobsoccurrences'
 
-        if first_scrap == False:
-            query = f"SELECT * FROM {nouvelle_table} WHERE date_of_search = '{date_of_search}'"
-            cursor = conn.cursor()
-            cursor.execute(query)
-            df_to_add = pd.DataFrame(cursor.fetchall(), columns = ['date_of_search', 'day_of_week', 'region', 'job_search', 'technologie', 'occurrences'])
-            data_du_jour_df = pd.concat([data_du_jour_df, df_to_add]).groupby(['date_of_search', 'day_of_week', 'region', 'job_search', 'technologie'], as_index=False).agg({'occurrences':'sum'})
-            cursor.execute(f"""DELETE FROM {nouvelle_table} WHERE date_of_search = '{date_of_search}'""")
-            conn.commit()
-            cursor.close() 
-
         # On obtient les données à insérer du DataFrame
-        data_to_insert = data_du_jour_df[['date_of_search', 'day_of_week', 'region', 'job_search', 'technologie', 'occurrences']].values
+        data_to_insert = data_du_jour_df[['date_of_search', 'day_of_week', 'region', 'job_search', 'technologie', 'occurrences']].values.tolist()
 
-        # On ajoute les données à la table jobsoccurrences
-        insert_query = f"INSERT INTO {nouvelle_table} (date_of_search, day_of_week, region, job_search, technologie, occurrences) VALUES (%s, %s, %s, %s, %s, %s)"       
-
-        # On execute la requête d'insertion pour chaque ligne de données
+        # On ajoute les données à la table jobsoccurrences en un seul envoi
         with conn.cursor() as cursor:
-            for row in data_to_insert:
-                cursor.execute(insert_query, row)
+            execute_values(cursor, f"""
+                INSERT INTO {nouvelle_table} (date_of_search, day_of_week, region, job_search, technologie, occurrences)
+                VALUES %s
+                ON CONFLICT (date_of_search, region, job_search, technologie)
+                DO UPDATE SET occurrences = {nouvelle_table}.occurrences + EXCLUDED.occurrences
+            """, data_to_insert, page_size=max(len(data_to_insert), 1))
+
+            # Cumul des occurrences de la journée pour le reporting
+            cursor.execute(f"SELECT COALESCE(SUM(occurrences), 0) FROM {nouvelle_table} WHERE date_of_search = %s", (date_of_search,))
+            daily_occurrences = cursor.fetchone()[0]
             conn.commit()
 
 
@@ -441,7 +473,7 @@ def lambda_handler(event, context):
         scrap_number = int(scrap_number)
 
         # Occurrences
-        occurrences = int(data_du_jour_df['occurrences'].sum())
+        occurrences = int(daily_occurrences)
 
         # Daily_jobs_scrap
         daily_job_scrap = int(daily_job_scrap)
@@ -455,48 +487,29 @@ def lambda_handler(event, context):
             SET 
                 occurrences  = %s,
                 daily_job_scrap = %s,
-                lambda_status = %s
+                lambda_status = %s,
+                duplicate_jobs = %s,
+                batch_duplicate_rate = %s
             WHERE reporting_date = %s
             AND scrap_number = %s;
-            """, (occurrences, daily_job_scrap, lambda_status, date_of_search, scrap_number))
+            """, (occurrences, daily_job_scrap, lambda_status, duplicate_jobs, batch_duplicate_rate, date_of_search, scrap_number))
         conn.commit()
 
-        # On met à jour l'insight "cloud" pour la page d'accueil du site
-        cursor.execute("""
-            WITH AWS AS (
-            	SELECT COUNT(*) AS nombre_vals
-            	FROM jobs
-            	WHERE technos LIKE '%AWS, %'
-            		OR technos LIKE '%, AWS'
-            		OR technos = 'AWS'
-            ),
-            GCP AS (
-            	SELECT COUNT(*) AS nombre_vals
-            	FROM jobs
-            	WHERE technos LIKE '%GCP, %'
-            		OR technos LIKE '%, GCP'
-            		OR technos = 'GCP'
-            ),
-            Azure AS (
-            	SELECT COUNT(*) AS nombre_vals
-            	FROM jobs
-            	WHERE technos LIKE '%Azure, %'
-            		OR technos LIKE '%, Azure'
-            		OR technos = 'Azure'
-            )
-            UPDATE cloud_count
-            SET cloud_count = (
-            	SELECT 
-            		(SELECT nombre_vals FROM AWS) +
-            		(SELECT nombre_vals FROM GCP) +
-            		(SELECT nombre_vals FROM Azure)
-            );
-        """)
+        # On met à jour l'insight "cloud" pour la page d'accueil du site, et les autres compteurs suivis
+        # Les compteurs sont incrémentés avec les annonces du fichier, les scripts de maintenance les recalculent
+        # exactement : plus de parcours de toute la table jobs à chaque fichier
+        add_techno_counts(cursor, techno_job_counts)
         conn.commit()
 
-        # Fermeture de la connexion
+        # Libération du verrou de maintenance et fermeture de la connexion
+        release_maintenance_lock(conn)
         conn.close()
 
+    except MaintenanceLockTimeout:
+        # Une maintenance garde le verrou exclusif (remplacement des tables, réécriture de city_error)
+        # Le fichier n'a pas été chargé : l'erreur remonte pour que l'invocation asynchrone soit relancée par S3,
+        # puis envoyée à la destination d'échec (DLQ) si le verrou reste indisponible
+        raise
     except Exception as e:
         print(f'test failed: {str(e)}')
     finally:
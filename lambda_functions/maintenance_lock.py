@@ -0,0 +1,61 @@
+import select
+import time
+
+
+# --------------------------------------------------------------
+# ------ Verrou de maintenance (advisory lock PostgreSQL) ------
+# --------------------------------------------------------------
+
+# Les écritures sur jobs / jobsoccurrences / city_error sont coordonnées par un verrou consultatif de session :
+# - partagé pour les ingestions (Lambda de nettoyage), qui peuvent tourner en parallèle
+# - exclusif pour la maintenance (database_cleaning, city_error), qui remplace ou réécrit les tables
+# Le verrou est libéré automatiquement si la connexion tombe, contrairement à la table maintenance
+# Module partagé : importé par la Lambda de nettoyage et par les scripts de python_scripts
+MAINTENANCE_LOCK_KEY = 20240101
+MAINTENANCE_CHANNEL = 'maintenance_lock'
+
+
+class MaintenanceLockTimeout(Exception):
+    pass
+
+
+# Prise du verrou : en cas d'échec, on attend la notification de libération (LISTEN / NOTIFY)
+# Un nouvel essai est fait au plus tard toutes les 5 secondes, au cas où le détenteur serait tombé sans notifier
+def acquire_maintenance_lock(conn, exclusive=False, timeout=600):
+    lock_function = 'pg_try_advisory_lock' if exclusive else 'pg_try_advisory_lock_shared'
+    deadline = time.monotonic() + timeout
+
+    cursor = conn.cursor()
+    cursor.execute(f"LISTEN {MAINTENANCE_CHANNEL}")
+    conn.commit()
+
+    try:
+        while True:
+            cursor.execute(f"SELECT {lock_function}(%s)", (MAINTENANCE_LOCK_KEY,))
+            acquired = cursor.fetchone()[0]
+            conn.commit()
+            if acquired:
+                return
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise MaintenanceLockTimeout(f'Verrou de maintenance indisponible après {timeout} s')
+
+            if select.select([conn], [], [], min(remaining, 5)) != ([], [], []):
+                conn.poll()
+                conn.notifies.clear()
+    finally:
+        cursor.execute(f"UNLISTEN {MAINTENANCE_CHANNEL}")
+        conn.commit()
+        cursor.close()
+
+
+# Libération du verrou et notification des processus en attente
+def release_maintenance_lock(conn, exclusive=False):
+    unlock_function = 'pg_advisory_unlock' if exclusive else 'pg_advisory_unlock_shared'
+
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT {unlock_function}(%s)", (MAINTENANCE_LOCK_KEY,))
+    cursor.execute(f"NOTIFY {MAINTENANCE_CHANNEL}")
+    conn.commit()
+    cursor.close()
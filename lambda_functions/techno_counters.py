@@ -0,0 +1,70 @@
+from psycopg2.extras import execute_values
+
+
+# ----------------------------------------------------
+# ------ Compteurs d'annonces par techno suivie ------
+# ----------------------------------------------------
+
+# techno_count contient les technos suivies (configurables : il suffit d'ajouter une ligne) et le nombre d'annonces
+# qui les citent. counter regroupe les technos d'un même indicateur, 'cloud' alimente la table cloud_count du site
+# La Lambda de nettoyage ajoute les annonces de chaque fichier aux compteurs ; les scripts de maintenance les
+# recalculent exactement, sous verrou de maintenance exclusif
+# Module partagé : importé par la Lambda de nettoyage et par les scripts de python_scripts
+# La table est créée par python_scripts/schema_migration.py
+TECHNO_COUNT_TABLE = """
+    CREATE TABLE IF NOT EXISTS techno_count (
+        techno VARCHAR(120) PRIMARY KEY,
+        counter VARCHAR(30) NOT NULL,
+        job_count BIGINT NOT NULL DEFAULT 0
+    );
+    INSERT INTO techno_count (techno, counter)
+    SELECT techno, 'cloud'
+    FROM (VALUES ('AWS'), ('GCP'), ('Azure')) AS cloud (techno)
+    WHERE NOT EXISTS (SELECT 1 FROM techno_count);
+"""
+
+
+# Recalcul exact des compteurs sur toute la table jobs, puis de cloud_count (validé avec la transaction en cours)
+# Une annonce compte une fois par techno suivie qu'elle cite (technos séparées par des virgules)
+def reconcile_techno_counts(cursor):
+    cursor.execute("""
+        WITH job_technos AS (
+            SELECT DISTINCT jobs.id, BTRIM(techno) AS techno
+            FROM jobs, unnest(string_to_array(jobs.technos, ',')) AS techno
+            WHERE BTRIM(techno) IN (SELECT techno FROM techno_count)
+        ),
+        exact_count AS (
+            SELECT techno, COUNT(*) AS job_count
+            FROM job_technos
+            GROUP BY techno
+        )
+        UPDATE techno_count
+        SET job_count = COALESCE(exact_count.job_count, 0)
+        FROM techno_count tracked
+        LEFT JOIN exact_count ON exact_count.techno = tracked.techno
+        WHERE techno_count.techno = tracked.techno;
+
+        UPDATE cloud_count
+        SET cloud_count = (SELECT COALESCE(SUM(job_count), 0) FROM techno_count WHERE counter = 'cloud');
+    """)
+
+
+# Ajout aux compteurs des annonces d'un fichier (validé avec la transaction en cours)
+# techno_job_counts : nombre d'annonces acceptées citant chaque techno (Series indexée par techno)
+# Incréments atomiques : deux Lambdas en parallèle ne s'écrasent pas
+def add_techno_counts(cursor, techno_job_counts):
+    cursor.execute("SELECT techno, counter FROM techno_count")
+    tracked_technos = dict(cursor.fetchall())
+    count_deltas = [(techno, int(techno_job_counts.get(techno, 0))) for techno in tracked_technos]
+    count_deltas = [(techno, delta) for techno, delta in count_deltas if delta > 0]
+
+    if count_deltas:
+        execute_values(cursor, """
+            UPDATE techno_count
+            SET job_count = techno_count.job_count + delta.job_count
+            FROM (VALUES %s) AS delta (techno, job_count)
+            WHERE techno_count.techno = delta.techno
+        """, count_deltas)
+
+        cloud_delta = sum(delta for techno, delta in count_deltas if tracked_technos[techno] == 'cloud')
+        cursor.execute("UPDATE cloud_count SET cloud_count = cloud_count + %s", (cloud_delta,))
@@ -0,0 +1,161 @@
+from collections import namedtuple
+from psycopg2.extras import execute_values
+import ast
+
+
+# -----------------------------------------------------------
+# ------ Dictionnaire des technos (tables normalisées) ------
+# -----------------------------------------------------------
+
+# La table lists (une seule chaîne par liste) reste la source des listes : elle est modifiée à la main et lue par le
+# scraper. Ses chaînes sont importées, déjà analysées, dans :
+# - techno_pattern : motifs recherchés dans les descriptions (techno_list et mini_list, dans leur ordre d'origine)
+# - techno_canonical / techno_alias : noms complets et appellations (clean_list)
+# - techno_dictionary : numéro de version, incrémenté par trigger à chaque modification des trois tables,
+#   et empreinte des chaînes de lists importées (lists_hash)
+# Le numéro de version se lit en une requête, le dictionnaire n'est relu que lorsqu'il change
+# Module partagé : importé par la Lambda de nettoyage et par les scripts de python_scripts
+# Les tables sont créées par python_scripts/schema_migration.py
+DICTIONARY_TABLES = """
+    CREATE TABLE IF NOT EXISTS techno_dictionary (
+        singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+        version BIGINT NOT NULL,
+        lists_hash CHAR(32)
+    );
+    INSERT INTO techno_dictionary (version) VALUES (1) ON CONFLICT DO NOTHING;
+
+    CREATE TABLE IF NOT EXISTS techno_pattern (
+        list VARCHAR(20) CHECK (list IN ('techno_list', 'mini_list')),
+        position INT,
+        pattern VARCHAR(120) NOT NULL,
+        PRIMARY KEY (list, position)
+    );
+
+    CREATE TABLE IF NOT EXISTS techno_canonical (
+        name VARCHAR(120) PRIMARY KEY
+    );
+
+    CREATE TABLE IF NOT EXISTS techno_alias (
+        alias VARCHAR(120) PRIMARY KEY,
+        canonical VARCHAR(120) NOT NULL REFERENCES techno_canonical (name) ON UPDATE CASCADE ON DELETE CASCADE
+    );
+
+    CREATE OR REPLACE FUNCTION bump_techno_dictionary_version() RETURNS trigger AS $$
+    BEGIN
+        UPDATE techno_dictionary SET version = version + 1;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS techno_pattern_version ON techno_pattern;
+    CREATE TRIGGER techno_pattern_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON techno_pattern
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_techno_dictionary_version();
+
+    DROP TRIGGER IF EXISTS techno_canonical_version ON techno_canonical;
+    CREATE TRIGGER techno_canonical_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON techno_canonical
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_techno_dictionary_version();
+
+    DROP TRIGGER IF EXISTS techno_alias_version ON techno_alias;
+    CREATE TRIGGER techno_alias_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON techno_alias
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_techno_dictionary_version();
+"""
+
+
+# Empreinte des trois chaînes de lists, comparée à celle de la dernière importation
+LISTS_HASH = """
+    SELECT MD5(STRING_AGG(list || '=' || values, '|' ORDER BY list))
+    FROM lists
+    WHERE list IN ('techno_list', 'mini_list', 'clean_list')
+"""
+
+
+TechnoDictionary = namedtuple('TechnoDictionary', ['version', 'techno_list', 'mini_list', 'techno_dict', 'alias_map'])
+
+# Cache du processus {version : TechnoDictionary}, seule la dernière version est gardée
+# Un conteneur Lambda réutilisé garde ainsi le dictionnaire en mémoire tant que la version ne change pas
+dictionary_cache = {}
+
+
+# Réimport des listes si l'empreinte de lists diffère de celle du dernier import (une requête sinon)
+# La ligne de techno_dictionary est verrouillée (FOR UPDATE) pendant l'import : deux imports simultanés
+# sont faits l'un après l'autre, le second voit l'empreinte à jour et ne fait rien
+def sync_dictionary(conn, cursor):
+    cursor.execute(f"SELECT lists_hash IS DISTINCT FROM ({LISTS_HASH}) FROM techno_dictionary")
+    if cursor.fetchone()[0]:
+        cursor.execute(f"SELECT lists_hash IS DISTINCT FROM ({LISTS_HASH}) FROM techno_dictionary FOR UPDATE")
+        if cursor.fetchone()[0]:
+            import_lists(cursor)
+            cursor.execute(f"UPDATE techno_dictionary SET lists_hash = ({LISTS_HASH})")
+    conn.commit()
+
+
+# Import des chaînes techno_list, mini_list et clean_list de la table lists (même analyse qu'auparavant)
+def import_lists(cursor):
+    cursor.execute("""
+    SELECT list, values
+    FROM lists
+    WHERE list IN ('techno_list', 'mini_list', 'clean_list')
+                    """)
+    raw_lists = dict(cursor.fetchall())
+
+    techno_list = [i.replace('"', '').strip() for i in raw_lists['techno_list'].replace("\n","").replace("'", "").strip().split(',')]
+    mini_list = [i.replace('"', '').strip() for i in raw_lists['mini_list'].replace("\n","").replace("'", "").strip().split(',')]
+    techno_dict = ast.literal_eval(raw_lists['clean_list'].replace('\n', ''))
+
+    save_dictionary(cursor, techno_list, mini_list, techno_dict)
+
+
+# Remplacement complet du dictionnaire (validé avec la transaction en cours)
+# Une appellation présente sous plusieurs noms complets garde le dernier, comme l'ancienne boucle sur clean_list
+def save_dictionary(cursor, techno_list, mini_list, techno_dict):
+    cursor.execute("DELETE FROM techno_pattern")
+    cursor.execute("DELETE FROM techno_alias")
+    cursor.execute("DELETE FROM techno_canonical")
+
+    alias_map = {alias: name for name, aliases in techno_dict.items() for alias in aliases}
+
+    execute_values(cursor, "INSERT INTO techno_pattern (list, position, pattern) VALUES %s",
+                   [('techno_list', position, pattern) for position, pattern in enumerate(techno_list)]
+                   + [('mini_list', position, pattern) for position, pattern in enumerate(mini_list)])
+    execute_values(cursor, "INSERT INTO techno_canonical (name) VALUES %s ON CONFLICT DO NOTHING",
+                   [(name,) for name in techno_dict])
+    execute_values(cursor, "INSERT INTO techno_alias (alias, canonical) VALUES %s",
+                   list(alias_map.items()))
+
+
+def dictionary_version(cursor):
+    cursor.execute("SELECT version FROM techno_dictionary")
+    return cursor.fetchone()[0]
+
+
+# Dictionnaire courant : une requête sur la version, puis lecture des tables seulement si la version a changé
+# Si le dictionnaire est modifié pendant la lecture, la version relue diffère et la lecture est refaite
+def load_dictionary(cursor):
+    version = dictionary_version(cursor)
+
+    while version not in dictionary_cache:
+        cursor.execute("SELECT list, pattern FROM techno_pattern ORDER BY list, position")
+        patterns = cursor.fetchall()
+        techno_list = [pattern for list_name, pattern in patterns if list_name == 'techno_list']
+        mini_list = [pattern for list_name, pattern in patterns if list_name == 'mini_list']
+
+        cursor.execute("""
+            SELECT techno_canonical.name, techno_alias.alias
+            FROM techno_canonical
+            LEFT JOIN techno_alias ON techno_alias.canonical = techno_canonical.name
+            ORDER BY techno_canonical.name, techno_alias.alias
+        """)
+        techno_dict = {}
+        alias_map = {}
+        for name, alias in cursor.fetchall():
+            aliases = techno_dict.setdefault(name, [])
+            if alias is not None:
+                aliases.append(alias)
+                alias_map[alias] = name
+
+        loaded_version, version = version, dictionary_version(cursor)
+        if loaded_version == version:
+            dictionary_cache.clear()
+            dictionary_cache[version] = TechnoDictionary(version, techno_list, mini_list, techno_dict, alias_map)
+
+    return dictionary_cache[version]
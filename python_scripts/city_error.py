@@ -1,6 +1,7 @@
 import pandas as pd
 import psycopg2
 import os
+import sys
 import logging
 import json
 import boto3
@@ -8,6 +9,11 @@ from botocore.exceptions import ClientError
 from datetime import date
 from sqlalchemy import create_engine
 
+# Le verrou de maintenance est partagé avec la Lambda de nettoyage
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+
+from maintenance_lock import acquire_maintenance_lock, release_maintenance_lock
+
 # Configuration du logger
 logging.basicConfig(filename='/home/ec2-user/logs/city_error_email.txt',
                     level=logging.ERROR,
@@ -74,6 +80,14 @@ try:
     """)
     city_df = pd.DataFrame(cursor.fetchall(), columns=['value'])
 
+    # Résolutions de villes mémorisées par la Lambda de nettoyage : seule la version la plus récemment écrite
+    # (règles de normalisation et reg_dep_com.csv en cours) est gardée, les précédentes ne sont plus lues
+    cursor.execute("""
+        DELETE FROM city_resolution
+        WHERE version <> (SELECT version FROM city_resolution ORDER BY created_at DESC LIMIT 1)
+    """)
+    conn.commit()
+
 
     if len(city_df) == 0:
 
@@ -107,6 +121,9 @@ try:
         """, (cities_to_add, date_of_search, scrap_number))
         conn.commit()
 
+        # La table est réécrite : on attend que les Lambdas de nettoyage en cours aient fini d'y insérer
+        acquire_maintenance_lock(conn, exclusive=True, timeout=int(os.environ.get('MAINTENANCE_LOCK_TIMEOUT', 600)))
+
         # On refait la table pour retirer les doublons si la même erreur arrive dans plusieurs scripts
         cursor.execute("""
             (SELECT value, status
@@ -136,6 +153,7 @@ try:
             logging.error(f"Erreur lors de la mise à jour : {e}")
 
         finally:
+            release_maintenance_lock(conn, exclusive=True)
             conn.close()
 
 except Exception as e:
@@ -0,0 +1,64 @@
+from psycopg2 import sql
+import threading
+import queue
+
+
+# ---------------------------------------------------------------
+# ------ COPY en mémoire alimenté par un thread producteur ------
+# ---------------------------------------------------------------
+
+# Objet fichier lu par copy_expert : les DataFrames sont convertis en CSV par un thread producteur
+# pendant que COPY envoie les morceaux précédents à la base, rien n'est écrit sur disque
+class CopyStream:
+
+    def __init__(self, frames, max_pending=4):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.buffer = ''
+        self.position = 0
+        self.finished = False
+        self.error = None
+        self.thread = threading.Thread(target=self.produce, args=(frames,), daemon=True)
+        self.thread.start()
+
+    def produce(self, frames):
+        try:
+            for frame in frames:
+                self.queue.put(frame.to_csv(index=False, header=False))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.queue.put(None)
+
+    # Retourne au plus size caractères du morceau en cours, une chaîne vide signale la fin à COPY
+    def read(self, size=-1):
+        while self.position >= len(self.buffer) and not self.finished:
+            chunk = self.queue.get()
+            if chunk is None:
+                self.finished = True
+            else:
+                self.buffer, self.position = chunk, 0
+
+        # Une erreur du producteur interrompt le COPY (la transaction sera annulée)
+        if self.error is not None:
+            raise self.error
+
+        end = len(self.buffer) if size is None or size < 0 else min(self.position + size, len(self.buffer))
+        data = self.buffer[self.position:end]
+        self.position = end
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+# Copie d'une suite de DataFrames dans une table via COPY ... FROM STDIN
+# frames peut être un générateur : chaque DataFrame est produit pendant que le précédent est chargé
+def copy_dataframes(cursor, table_name, columns, frames):
+    stream = CopyStream(frames)
+    cursor.copy_expert(sql.SQL("COPY {} ({}) FROM STDIN WITH CSV").format(
+        sql.Identifier(table_name),
+        sql.SQL(', ').join(sql.Identifier(column) for column in columns)), stream)
+    stream.thread.join()
+
+    if stream.error is not None:
+        raise stream.error
@@ -1,15 +1,27 @@
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 from botocore.exceptions import ClientError
 import psycopg2
 import pandas as pd
-import re
-import ast
+import argparse
 import os
-import time
+import sys
 import json
 import boto3
 import os
 
+# Le verrou de maintenance, le dictionnaire des technos et les compteurs sont partagés avec la Lambda de nettoyage
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+
+from maintenance_lock import MaintenanceLockTimeout, acquire_maintenance_lock, release_maintenance_lock
+from techno_counters import reconcile_techno_counts
+from techno_dictionary import load_dictionary, sync_dictionary
+from techno_matching import build_alias_map, build_technology_finder, create_extraction_pool, description_hash, extract_technos_cached, extract_technos_parallel
+from token_index import TokenIndex, changed_technos
+from copy_stream import copy_dataframes
+from shadow_table import build_shadow_indexes, create_shadow_table, swap_shadow_tables
+from maintenance_checkpoint import clear_checkpoints, id_ranges, load_checkpoints, record_checkpoint
+
 # Récupération des variables d'environnement
 def get_secret():
 
@@ -43,125 +55,139 @@ def get_secret():
 
     return database, user, password, host, port
 
-database, user, password, host, port = get_secret()
-
-
-# Création de la connexion psycopg2 pour récupérer les listes
-conn = psycopg2.connect(database=database, 
-                        user=user, 
-                        password=password, 
-                        host=host, 
-                        port=port)
-cursor = conn.cursor() 
-
-maintenance_bool = False
-
-# Vérification de l'état de la base de données
-for i in range(20):
-        cursor.execute("SELECT * FROM maintenance")
-        database_state = cursor.fetchall()[0][0]
-        conn.commit()
-
-        if database_state == 'available':
-            maintenance_bool = False
-            break
-        else:
-            time.sleep(10)
-            continue
-
-# La base est indisponible, on ne lance pas le script
-if maintenance_bool == True:
-    conn.close()
-
-# La base de données est disponible, on lance donc le script. 
-else: 
-
-    # --------------------------------------------
-    # ------ Récupération des listes en BDD ------
-    # --------------------------------------------
-
-    # Récupération de la liste des technos plus de 4 caractères
-    cursor = conn.cursor()
-    cursor.execute("""
-    SELECT values
-    FROM lists
-    WHERE list = 'techno_list'
-                    """)  
-    techno_list = [i.replace('"', '').strip() for i in cursor.fetchall()[0][0].replace("\n","").replace("'", "").strip().split(',')]
+# Comptage des technos par date, région et métier (format de la table jobsoccurrences)
+def count_occurrences(dataframe):
 
-    # Récupération de la liste des technos de 4 caractères et moins
-    cursor.execute("""
-    SELECT values
-    FROM lists
-    WHERE list = 'mini_list'
-                    """)  
-    mini_list = [i.replace('"', '').strip() for i in cursor.fetchall()[0][0].replace("\n","").replace("'", "").strip().split(',')]
-
-    # Récupération de la liste des technos correctement écrites
-    cursor.execute("""
-    SELECT values
-    FROM lists
-    WHERE list = 'clean_list'
-                    """)
-    techno_dict = ast.literal_eval(cursor.fetchall()[0][0].replace('\n', ''))
+    # On transforme la colonne techno en liste afin de récupérer chaque élément
+    jobsoccurrences_dataframe = dataframe[['date_of_search', 'day_of_week', 'region', 'job_search', 'technos']].copy()
+    jobsoccurrences_dataframe['technos'] = jobsoccurrences_dataframe['technos'].str.split(',').apply(lambda x: [s.strip() for s in x])
 
+    # Explode sur les technos afin de faire 1 ligne par technos
+    jobsoccurrences_dataframe = jobsoccurrences_dataframe.explode('technos')
 
-    # --------------------------------------------------
-    # ------ Déclaration de l'état de maintenance ------
-    # --------------------------------------------------
+    # Création de la colonne occurrences afin de faire une somme avec groupby ensuite
+    jobsoccurrences_dataframe['occurrences'] = 1
 
+    # Que voilà ici, on met as_index=False sinon le group_by ne remet pas les valeurs dans chaque ligne
+    jobsoccurrences_dataframe = jobsoccurrences_dataframe.groupby(['date_of_search', 'day_of_week', 'region', 'job_search', 'technos'], as_index=False).agg({'occurrences':'sum'})
+    return jobsoccurrences_dataframe.rename(columns={"technos": "technologie"})
+
+
+# Même comptage que count_occurrences, réalisé entièrement dans la base à partir d'une table d'annonces
+# Aucune ligne ne transite par le réseau : string_to_array + unnest remplacent le split / explode
+# Comme en pandas, une annonce sans techno (technos vide, ou NULL après COPY) compte une fois pour une techno vide,
+# écrite NULL comme le fait COPY, et les lignes avec une clé NULL sont ignorées
+def insert_occurrences_from_jobs(cursor, jobs_table_name, table_name):
+    cursor.execute(sql.SQL("""
+        INSERT INTO {} (date_of_search, day_of_week, region, job_search, technologie, occurrences)
+        SELECT date_of_search, day_of_week, region, job_search, NULLIF(BTRIM(technologie, E' \\t\\n\\r'), ''), COUNT(*)
+        FROM {},
+            UNNEST(CASE WHEN COALESCE(technos, '') = '' THEN ARRAY[''] ELSE STRING_TO_ARRAY(technos, ',') END) AS technologie
+        WHERE date_of_search IS NOT NULL
+        AND day_of_week IS NOT NULL
+        AND region IS NOT NULL
+        AND job_search IS NOT NULL
+        GROUP BY date_of_search, day_of_week, region, job_search, NULLIF(BTRIM(technologie, E' \\t\\n\\r'), '')
+    """).format(sql.Identifier(table_name), sql.Identifier(jobs_table_name)))
+
+
+# Chargement en mémoire du cache {hash de la description : technos} pour la version courante des listes
+# Les entrées des anciennes versions ne seront plus jamais lues, elles sont supprimées
+# Sans preload (mode --stream), le cache n'est pas chargé : il est lu paquet par paquet (batch_techno_cache)
+def load_techno_cache(conn, cursor, version, preload=True):
     cursor.execute("""
-        UPDATE maintenance 
-        SET status = 'maintenance';
+        CREATE TABLE IF NOT EXISTS techno_cache (
+            description_hash CHAR(40),
+            dictionary_version CHAR(40),
+            technos TEXT,
+            PRIMARY KEY (description_hash, dictionary_version)
+        );
     """)
+    cursor.execute("DELETE FROM techno_cache WHERE dictionary_version <> %s", (version,))
     conn.commit()
 
-
-    # ------------------------------------
-    # ------ Création des fonctions ------
-    # ------------------------------------
-
-    # Cette fonction permet de récupérer les technologies dans chaque description
-    def technology_finder(description):
-        # Récupération des technos dans la description
-        technos = [i for i in techno_list if i in description.replace(' ', '')]
-
-        # Les mots de 4 lettres et moins sont récupérés via du Regex sur la description
-        for mot in mini_list:
-            # re.escape permet de ne pas prendre en compte les caractères spéciaux, sinon erreur de code
-            mot_escaped = re.escape(mot)
-            if re.findall(r'(?<!\S){}(?!\S)'.format(mot_escaped), description):
-                technos.append(mot)
-
-        # On joint les deux listes de technos en une seule                                                                           
-        technos = ', '.join(technos)
-        return technos
-
-
-    # Cette fonction va nettoyer les technos en mettant le nom correct
-    def replace_technos(row):
-        technos_list = row.split(', ')
-        for index, techno in enumerate(technos_list):
-            for key, value in techno_dict.items():
-                if techno in value:
-                    technos_list[index] = key
-        return (', ').join(technos_list)
-
-
-    # Cette fonction va supprimer les doublons de technos
-    def remove_duplicates(row):
-        technos_list = row.split(', ')
-        unique_technos = list(set(technos_list))
-        return ', '.join(unique_technos)
-
+    if not preload:
+        return None
+
+    cursor.execute("SELECT description_hash, technos FROM techno_cache WHERE dictionary_version = %s", (version,))
+    return dict(cursor.fetchall())
+
+
+# Cache à utiliser pour un paquet de descriptions : le cache complet s'il est en mémoire,
+# sinon les seules entrées de ces descriptions, lues dans la base
+def batch_techno_cache(conn, version, techno_cache, descriptions):
+    if techno_cache is not None:
+        return techno_cache
+
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT description_hash, technos
+            FROM techno_cache
+            WHERE dictionary_version = %s
+            AND description_hash = ANY(%s)
+        """, (version, list(set(descriptions.map(description_hash)))))
+        return dict(cursor.fetchall())
+
+
+# Enregistrement des nouvelles entrées du cache (validé avec la transaction en cours)
+def save_techno_cache(cursor, version, new_entries):
+    if not new_entries:
+        return
+    execute_values(cursor, """
+        INSERT INTO techno_cache (description_hash, dictionary_version, technos)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+    """, [(description_hash, version, technos) for description_hash, technos in new_entries.items()])
+
+
+# Lecture des annonces de jobs, par ordre d'id décroissant
+# Sans batch_size, toute la table est chargée en une fois
+# Avec batch_size, un curseur nommé (côté serveur) renvoie des paquets de taille fixe : la mémoire reste bornée
+# Avec id_range (début, fin exclue), seule cette tranche d'id est lue
+# Avec missing_from, seules les annonces absentes de cette table sont lues (rattrapage avant le remplacement)
+def read_jobs(conn, columns, batch_size=None, id_range=None, table_name='jobs', missing_from=None):
+    conditions = []
+    if id_range:
+        conditions.append(sql.SQL("id >= %s AND id < %s"))
+    if missing_from:
+        conditions.append(sql.SQL("NOT EXISTS (SELECT 1 FROM {0} WHERE {0}.id = {1}.id)").format(
+            sql.Identifier(missing_from),
+            sql.Identifier(table_name)))
+
+    select_query = sql.SQL("SELECT {} FROM {} {} ORDER BY id DESC").format(
+        sql.SQL(', ').join(sql.Identifier(column) for column in columns),
+        sql.Identifier(table_name),
+        sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL(""))
+
+    if not batch_size:
+        with conn.cursor() as cursor:
+            cursor.execute(select_query, id_range)
+            yield pd.DataFrame(cursor.fetchall(), columns=columns)
+    else:
+        with conn.cursor(name='jobs_stream') as stream_cursor:
+            stream_cursor.itersize = batch_size
+            stream_cursor.execute(select_query, id_range)
+            while True:
+                rows = stream_cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=columns)
+
+    # Fin de la transaction de lecture : sur une connexion dédiée, elle garderait sinon un verrou sur jobs
+    # qui bloquerait son remplacement
+    conn.rollback()
+
+
+# Reconstruction complète de jobs et jobsoccurrences à partir de toutes les descriptions
+# Les annonces sont traitées par tranches d'id, chaque tranche terminée est enregistrée comme point de reprise
+# Avec --resume, les tranches déjà chargées dans jobs_temp par une exécution interrompue ne sont pas refaites
+# Retourne l'index inversé des descriptions, construit au passage seulement s'il doit être sauvegardé (TOKEN_INDEX_PATH)
+def full_rebuild(conn, cursor, read_conn, extract, version, techno_cache, args):
 
     # ------------------------------
     # ------ Création de jobs ------
     # ------------------------------
 
-    # Table en production
-    production_table = "jobs"
-
     # Colonnes à exporter 
     output_columns = ['id', 
                     'date_of_search', 
@@ -179,172 +205,479 @@ else:
                     'job_type', 
                     'sector']
 
-    # Construction de la requête SELECT
-    columns_str = ', '.join(output_columns)
-    select_query = f"SELECT {columns_str} FROM {production_table} ORDER BY id DESC"
-
-    cursor.execute(select_query)
-    working_dataframe = pd.DataFrame(cursor.fetchall(), columns=columns_str.split(', '))
-
-    # Création de la colonne technos à partir de la fonction. 
-    working_dataframe['technos'] = working_dataframe['description'].apply(technology_finder)
-    working_dataframe['technos'] = working_dataframe['technos'].apply(replace_technos)
-    working_dataframe['technos'] = working_dataframe['technos'].apply(remove_duplicates)
-    working_dataframe['scrap_number'] = working_dataframe['scrap_number'].astype(str).replace('nan', '0').astype(float).astype(int)
-
-    # Remise en ordre du dataframe
-    working_dataframe = working_dataframe[['id', 
-                                            'date_of_search', 
-                                            'scrap_number', 
-                                            'day_of_week', 
-                                            'job_search', 
-                                            'job_name', 
-                                            'company_name', 
-                                            'city_name', 
-                                            'city', 
-                                            'region', 
-                                            'technos',
-                                            'description', 
-                                            'lower_salary', 
-                                            'upper_salary', 
-                                            'job_type', 
-                                            'sector']]
-
-    # Création d'une table vide temporaire pour y insérer les données
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS jobs_temp (
-        id SERIAL,
-        date_of_search DATE,
-        scrap_number INT,
-        day_of_week VARCHAR(20),
-        job_search VARCHAR(30),
-        job_name VARCHAR(300),
-        company_name VARCHAR(300),
-        city_name VARCHAR(120),
-        city VARCHAR(120),
-        region VARCHAR(120),
-        technos TEXT,
-        description TEXT,
-        lower_salary FLOAT,
-        upper_salary FLOAT,
-        job_type VARCHAR(120),
-        sector VARCHAR(300)
-    )
-    """)
-    conn.commit()
+    # Ordre des colonnes de jobs_temp
+    jobs_columns = ['id', 
+                    'date_of_search', 
+                    'scrap_number', 
+                    'day_of_week', 
+                    'job_search', 
+                    'job_name', 
+                    'company_name', 
+                    'city_name', 
+                    'city', 
+                    'region', 
+                    'technos',
+                    'description', 
+                    'lower_salary', 
+                    'upper_salary', 
+                    'job_type', 
+                    'sector']
 
-    # Récupération de la séquence MAX +1 pour l'ID de séquence
-    new_id_sequence = working_dataframe['id'].max() + 1
+    # Tranches déjà chargées dans jobs_temp lors d'une exécution interrompue (avec les mêmes listes)
+    completed = load_checkpoints(conn, cursor, version, 'jobs_temp')
+
+    if args.resume and completed:
+        print(f'Reprise de la reconstruction : {len(completed)} tranches déjà traitées')
+    else:
+        # Création d'une table vide temporaire pour y insérer les données, même définition que jobs (sans les index)
+        completed = set()
+        clear_checkpoints(conn, cursor)
+        create_shadow_table(conn, cursor, 'jobs', 'jobs_temp')
+
+    # L'index des descriptions n'est construit que s'il doit être sauvegardé (TOKEN_INDEX_PATH)
+    token_index = TokenIndex() if os.environ.get('TOKEN_INDEX_PATH') else None
+    occurrences_batches = []
+    new_cache_entries = {}
+
+    # En mode --stream, les occurrences sont comptées dans la base pour ne rien accumuler en mémoire
+    # Celles des tranches reprises n'ont pas été gardées en mémoire : elles sont aussi comptées dans la base
+    occurrences_in_db = args.occurrences_in_db or args.stream or bool(completed)
+
+    # Préparation des paquets : lecture sur une connexion dédiée, extraction des technos, mise en forme
+    # Ce générateur tourne dans le thread producteur pendant que COPY charge les paquets précédents
+    # Il n'utilise donc jamais conn, occupée par le COPY
+    def processed_batches(batches):
+        for working_dataframe in batches:
+
+            # Création de la colonne technos : recherche dans la description puis nettoyage (nom correct + suppression des doublons)
+            # Les descriptions déjà traitées avec cette version des listes sont lues dans le cache
+            working_dataframe['technos'], new_entries = extract_technos_cached(working_dataframe['description'],
+                                                                               batch_techno_cache(read_conn, version, techno_cache, working_dataframe['description']),
+                                                                               extract)
+            new_cache_entries.update(new_entries)
+            working_dataframe['scrap_number'] = working_dataframe['scrap_number'].astype(str).replace('nan', '0').astype(float).astype(int)
+
+            # On ne garde du paquet que les occurrences agrégées et l'index des descriptions
+            if not occurrences_in_db:
+                occurrences_batches.append(count_occurrences(working_dataframe))
+            if token_index is not None:
+                token_index.add(working_dataframe['id'], working_dataframe['description'])
+
+            yield working_dataframe[jobs_columns]
+
+    batch_size = args.batch_size if args.stream else None
+    for id_range in id_ranges(cursor, 'jobs', args.checkpoint_size)[::-1]:
+
+        # Tranche déjà chargée : seul l'index des descriptions est complété, à partir de jobs_temp
+        if id_range in completed:
+            if token_index is not None:
+                for done_dataframe in read_jobs(read_conn, ['id', 'description'], batch_size, id_range, 'jobs_temp'):
+                    token_index.add(done_dataframe['id'], done_dataframe['description'])
+            continue
 
-    # Mise en place du nouvel id de séquence dans la table 
-    cursor.execute(f"""
-        ALTER SEQUENCE jobs_temp_id_seq RESTART WITH {new_id_sequence};
-    """)
-    conn.commit()
+        # Une tranche à refaire peut avoir été chargée en partie, ou sous d'autres bornes (annonces ajoutées depuis l'interruption)
+        if completed:
+            cursor.execute("DELETE FROM jobs_temp WHERE id >= %s AND id < %s", id_range)
 
-    working_dataframe.to_csv(os.environ['JOBS_FILE_PATH'], index=False)
-    time.sleep(5)
+        # Copie directe des paquets dans jobs_temp, sans fichier intermédiaire
+        # La copie, le cache et le point de reprise sont validés ensemble : une interruption fait perdre au plus une tranche
+        copy_dataframes(cursor, 'jobs_temp', jobs_columns, processed_batches(read_jobs(read_conn, output_columns, batch_size, id_range)))
+        save_techno_cache(cursor, version, new_cache_entries)
+        record_checkpoint(cursor, version, id_range)
+        conn.commit()
+        new_cache_entries.clear()
 
-    # Copier les données depuis le fichier CSV en utilisant copy_expert
-    with open(os.environ['JOBS_FILE_PATH'], 'r') as f:
-        # Utiliser la méthode copy_expert pour copier les données depuis le fichier CSV
-        cursor.copy_expert(sql.SQL("COPY {} FROM STDIN WITH CSV HEADER").format(
-            sql.Identifier('jobs_temp')), f)
-        # Fermer le fichier
-        f.close()
+    # Toutes les étapes suivantes peuvent être rejouées par une reprise : index supprimés puis recréés, rattrapage
+    # par différence avec jobs, jobsoccurrences_temp recréée à partir de tout jobs_temp, jobs_temp modifiée
+    # seulement dans la transaction de l'échange
 
-    conn.commit()
+    # Les index sont construits après le chargement (plus rapide qu'une mise à jour ligne à ligne)
+    # et avant la prise du verrou : le rattrapage n'ajoute ensuite que quelques lignes
+    jobs_renames = build_shadow_indexes(conn, cursor, 'jobs', 'jobs_temp')
 
-    # Remplacement de la table originelle
-    cursor.execute("""
-    DELETE FROM jobs_temp WHERE technos IS NULL;
-    """)
-    conn.commit()
+    # ---------------------------------------------------
+    # ------ Rattrapage et remplacement des tables ------
+    # ---------------------------------------------------
 
-    # Remplacement de la table originelle
-    cursor.execute("""
-    ALTER TABLE jobs
-    RENAME TO jobs_to_delete;
-    """)
-    conn.commit()
+    # Les Lambdas de nettoyage ont pu écrire dans jobs pendant la reconstruction : le verrou exclusif attend
+    # la fin de celles en cours et bloque les suivantes jusqu'au remplacement des tables
+    # En cas d'abandon, jobs_temp et ses points de reprise sont gardés pour une exécution avec --resume
+    acquire_maintenance_lock(conn, exclusive=True, timeout=args.lock_timeout)
+    try:
+        # Annonces supprimées de jobs depuis leur lecture
+        cursor.execute("""
+            DELETE FROM jobs_temp
+            WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE jobs.id = jobs_temp.id)
+        """)
+        removed_jobs = cursor.rowcount
+        conn.commit()
 
-    cursor.execute("""
-    ALTER TABLE jobs_temp
-    RENAME TO jobs;
-    """)
-    conn.commit()
+        # Annonces ajoutées dans jobs depuis la lecture : même traitement que les autres
+        copy_dataframes(cursor, 'jobs_temp', jobs_columns, processed_batches(read_jobs(read_conn, output_columns, batch_size, missing_from='jobs_temp')))
+        save_techno_cache(cursor, version, new_cache_entries)
+        conn.commit()
 
-    cursor.execute("""
-    DROP TABLE jobs_to_delete;
-    """)
+        # Les occurrences comptées en mémoire incluent les annonces supprimées : elles sont alors recomptées dans la base
+        if removed_jobs:
+            print(f'{removed_jobs} annonces supprimées pendant la reconstruction, occurrences recomptées dans la base')
+            occurrences_in_db = True
+
+        # -----------------------------------------
+        # ------ Création de jobsoccurrences ------
+        # -----------------------------------------
+
+        # Création d'une table vide temporaire pour y insérer les données, même définition que jobsoccurrences
+        create_shadow_table(conn, cursor, 'jobsoccurrences', 'jobsoccurrences_temp')
+
+        if occurrences_in_db:
+            # Agrégation directement dans la base à partir de jobs_temp, annonces sans technos comprises
+            insert_occurrences_from_jobs(cursor, 'jobs_temp', 'jobsoccurrences_temp')
+        else:
+            # Les occurrences de chaque paquet sont additionnées puis copiées depuis la mémoire
+            jobsoccurrences_dataframe = pd.concat(occurrences_batches)
+            jobsoccurrences_dataframe = jobsoccurrences_dataframe.groupby(['date_of_search', 'day_of_week', 'region', 'job_search', 'technologie'], as_index=False).agg({'occurrences':'sum'})
+            copy_dataframes(cursor, 'jobsoccurrences_temp', list(jobsoccurrences_dataframe.columns), [jobsoccurrences_dataframe])
+        conn.commit()
+
+        jobsoccurrences_renames = build_shadow_indexes(conn, cursor, 'jobsoccurrences', 'jobsoccurrences_temp')
+
+        # Suppression des annonces sans technos, après le comptage : comme auparavant, elles comptent dans jobsoccurrences
+        # (technologie NULL), quelle que soit la méthode de comptage
+        # Elle est validée avec l'échange : une reprise après interruption recompte toujours à partir de tout jobs_temp
+        def delete_jobs_without_technos():
+            cursor.execute("""
+            DELETE FROM jobs_temp WHERE technos IS NULL;
+            """)
+
+        # ANALYZE puis remplacement des deux tables en une seule transaction
+        swap_shadow_tables(conn, cursor, [('jobs', 'jobs_temp', jobs_renames),
+                                          ('jobsoccurrences', 'jobsoccurrences_temp', jobsoccurrences_renames)],
+                           before_swap=delete_jobs_without_technos)
+
+        # Les technos des annonces ont changé : recalcul exact des compteurs suivis (dont cloud_count), avant que
+        # les Lambdas de nettoyage ne recommencent à les incrémenter
+        reconcile_techno_counts(cursor)
+        conn.commit()
+    finally:
+        conn.rollback()
+        release_maintenance_lock(conn, exclusive=True)
+
+    clear_checkpoints(conn, cursor)
+
+    return token_index
+
+
+# Mise à jour incrémentale : seules les annonces contenant une techno ajoutée ou retirée sont relues
+# Les annonces sont retrouvées via l'index inversé, jobsoccurrences est corrigé par différence
+def incremental_update(conn, cursor, token_index, techno_list, mini_list, techno_dict, extract, version, techno_cache, lock_timeout):
+
+    # Ajout à l'index des annonces arrivées depuis la dernière exécution
+    cursor.execute("SELECT id, description FROM jobs WHERE id > %s", (token_index.max_id,))
+    new_jobs = pd.DataFrame(cursor.fetchall(), columns=['id', 'description'])
+    token_index.add(new_jobs['id'], new_jobs['description'])
+
+    # Technos modifiées depuis la dernière exécution et annonces concernées
+    changed_techno, changed_mini = changed_technos(token_index.lists, (techno_list, mini_list, techno_dict))
+    candidate_ids = token_index.candidates(changed_techno, changed_mini)
+
+    if candidate_ids is not None and len(candidate_ids) == 0:
+        print('Aucune annonce concernée par la modification des listes')
+        return
+
+    columns = ['id', 'date_of_search', 'day_of_week', 'region', 'job_search', 'technos', 'description']
+    if candidate_ids is None:
+        cursor.execute(f"SELECT {', '.join(columns)} FROM jobs")
+    else:
+        cursor.execute(f"SELECT {', '.join(columns)} FROM jobs WHERE id = ANY(%s)", ([int(i) for i in candidate_ids],))
+    old_dataframe = pd.DataFrame(cursor.fetchall(), columns=columns)
+    old_dataframe = old_dataframe[old_dataframe['technos'].notna()]
+
+    # Nouvelles technos, on ne garde que les annonces dont l'ensemble de technos change
+    new_dataframe = old_dataframe.copy()
+    new_dataframe['technos'], new_entries = extract_technos_cached(new_dataframe['description'],
+                                                                   batch_techno_cache(conn, version, techno_cache, new_dataframe['description']),
+                                                                   extract)
+    save_techno_cache(cursor, version, new_entries)
     conn.commit()
 
+    changed = technos_changed(old_dataframe['technos'], new_dataframe['technos'])
+    old_dataframe, new_dataframe = old_dataframe[changed], new_dataframe[changed]
 
-    # -----------------------------------------
-    # ------ Création de jobsoccurrences ------
-    # -----------------------------------------
+    print(f'{len(candidate_ids) if candidate_ids is not None else "Toutes les"} annonces candidates, {len(new_dataframe)} annonces modifiées')
+    apply_technos_changes(conn, cursor, old_dataframe, new_dataframe, lock_timeout)
 
-    jobsoccurrences_dataframe = working_dataframe
 
-    # On transforme la colonne techno en liste afin de récupérer chaque élément
-    jobsoccurrences_dataframe['technos'] = jobsoccurrences_dataframe['technos'].str.split(',').apply(lambda x: [s.strip() for s in x])
+# Mise à jour par différence : toutes les descriptions sont relues, mais seules les annonces dont les technos
+# changent sont écrites (volume d'écriture proportionnel au changement, pas à la taille de la table)
+def diff_update(conn, cursor, read_conn, extract, version, techno_cache, args):
 
-    # Explode sur les technos afin de faire 1 ligne par technos
-    jobsoccurrences_dataframe = jobsoccurrences_dataframe.explode('technos')
+    columns = ['id', 'date_of_search', 'day_of_week', 'region', 'job_search', 'technos', 'description']
+    old_changes = []
+    new_changes = []
+    jobs_count = 0
 
-    # Création de la colonne occurrences afin de faire une somme avec groupby ensuite
-    jobsoccurrences_dataframe['occurrences'] = 1
+    for old_dataframe in read_jobs(read_conn, columns, args.batch_size if args.stream else None):
+        old_dataframe = old_dataframe[old_dataframe['technos'].notna()]
+        jobs_count += len(old_dataframe)
 
-    # Que voilà ici, on met as_index=False sinon le group_by ne remet pas les valeurs dans chaque ligne
-    jobsoccurrences_dataframe = jobsoccurrences_dataframe.groupby(['date_of_search', 'day_of_week', 'region', 'job_search', 'technos'], as_index=False).agg({'occurrences':'sum'})
-    jobsoccurrences_dataframe = jobsoccurrences_dataframe.rename(columns={"technos": "technologie"})
+        new_dataframe = old_dataframe.copy()
+        new_dataframe['technos'], new_entries = extract_technos_cached(new_dataframe['description'],
+                                                                       batch_techno_cache(read_conn, version, techno_cache, new_dataframe['description']),
+                                                                       extract)
 
+        # Le cache est enregistré paquet par paquet : une exécution interrompue n'a pas à tout réextraire
+        save_techno_cache(cursor, version, new_entries)
+        conn.commit()
 
-    # Création d'une table vide temporaire pour y insérer les données
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS jobsoccurrences_temp (
-            date_of_search DATE,
-            day_of_week VARCHAR(20),
-            region VARCHAR(120),
-            job_search VARCHAR(30),
-            technologie VARCHAR(120),
-            occurrences INT
-        );
-    """)
-    conn.commit()
+        # On ne garde en mémoire que les annonces modifiées, sans leur description
+        changed = technos_changed(old_dataframe['technos'], new_dataframe['technos'])
+        old_changes.append(old_dataframe.loc[changed, columns[:-1]])
+        new_changes.append(new_dataframe.loc[changed, columns[:-1]])
+
+    print(f'{jobs_count} annonces relues, {sum(len(frame) for frame in new_changes)} annonces modifiées')
+    if new_changes:
+        apply_technos_changes(conn, cursor, pd.concat(old_changes), pd.concat(new_changes), args.lock_timeout)
+
+
+# Annonces dont l'ensemble de technos change (l'ordre des technos n'est pas significatif)
+def technos_changed(old_technos, new_technos):
+    return [set(old.split(', ')) != set(new.split(', ')) for old, new in zip(old_technos, new_technos)]
+
+
+# Écriture des annonces modifiées et correction de jobsoccurrences, en une transaction
+# Les nouvelles technos sont copiées dans une table temporaire puis appliquées par un seul UPDATE ... FROM
+# La différence d'occurrences (+1 nouvelles technos, -1 anciennes) est appliquée de la même façon
+# Comme lors d'une reconstruction complète, une annonce qui n'a plus de techno est supprimée de jobs et compte
+# dans jobsoccurrences pour une techno NULL (technos vide écrit NULL par COPY)
+def apply_technos_changes(conn, cursor, old_dataframe, new_dataframe, lock_timeout):
+    if len(new_dataframe) == 0:
+        return
+
+    # Différence d'occurrences : +1 pour les nouvelles technos, -1 pour les anciennes
+    # Une ligne par date, région, métier et techno (le jour de la semaine découle de la date)
+    old_occurrences = count_occurrences(old_dataframe)
+    old_occurrences['occurrences'] = -old_occurrences['occurrences']
+    delta = pd.concat([count_occurrences(new_dataframe), old_occurrences])
+    delta = delta.groupby(['date_of_search', 'region', 'job_search', 'technologie'], as_index=False).agg({'day_of_week': 'first', 'occurrences': 'sum'})
+    delta = delta[delta['occurrences'] != 0][['date_of_search', 'day_of_week', 'region', 'job_search', 'technologie', 'occurrences']]
+
+    # Les technos sont réécrites en place : le verrou exclusif attend la fin des Lambdas de nettoyage en cours,
+    # qui recomptent les occurrences de leur journée à partir de jobs
+    acquire_maintenance_lock(conn, exclusive=True, timeout=lock_timeout)
+    try:
+        cursor.execute("""
+            CREATE TEMP TABLE jobs_technos_changes (
+                id INT PRIMARY KEY,
+                technos TEXT
+            ) ON COMMIT DROP;
+        """)
+        copy_dataframes(cursor, 'jobs_technos_changes', ['id', 'technos'], [new_dataframe[['id', 'technos']]])
+
+        cursor.execute("""
+            UPDATE jobs
+            SET technos = changes.technos
+            FROM jobs_technos_changes changes
+            WHERE jobs.id = changes.id
+            AND changes.technos IS NOT NULL;
+
+            DELETE FROM jobs
+            USING jobs_technos_changes changes
+            WHERE jobs.id = changes.id
+            AND changes.technos IS NULL;
+        """)
+
+        cursor.execute("""
+            CREATE TEMP TABLE jobsoccurrences_delta (
+                date_of_search DATE,
+                day_of_week VARCHAR(20),
+                region VARCHAR(120),
+                job_search VARCHAR(30),
+                technologie VARCHAR(120),
+                occurrences INT
+            ) ON COMMIT DROP;
+        """)
+        copy_dataframes(cursor, 'jobsoccurrences_delta', list(delta.columns), [delta])
+
+        # Application de la différence : mise à jour des lignes existantes, ajout des nouvelles, suppression des lignes à 0
+        # Une techno NULL est une clé comme une autre (IS NOT DISTINCT FROM)
+        cursor.execute("""
+            UPDATE jobsoccurrences o
+            SET occurrences = o.occurrences + d.occurrences
+            FROM jobsoccurrences_delta d
+            WHERE o.date_of_search = d.date_of_search
+            AND o.region IS NOT DISTINCT FROM d.region
+            AND o.job_search IS NOT DISTINCT FROM d.job_search
+            AND o.technologie IS NOT DISTINCT FROM d.technologie;
+
+            INSERT INTO jobsoccurrences (date_of_search, day_of_week, region, job_search, technologie, occurrences)
+            SELECT d.date_of_search, d.day_of_week, d.region, d.job_search, d.technologie, d.occurrences
+            FROM jobsoccurrences_delta d
+            WHERE d.occurrences > 0
+            AND NOT EXISTS (
+                SELECT 1
+                FROM jobsoccurrences o
+                WHERE o.date_of_search = d.date_of_search
+                AND o.region IS NOT DISTINCT FROM d.region
+                AND o.job_search IS NOT DISTINCT FROM d.job_search
+                AND o.technologie IS NOT DISTINCT FROM d.technologie);
+
+            DELETE FROM jobsoccurrences o
+            USING jobsoccurrences_delta d
+            WHERE o.date_of_search = d.date_of_search
+            AND o.region IS NOT DISTINCT FROM d.region
+            AND o.job_search IS NOT DISTINCT FROM d.job_search
+            AND o.technologie IS NOT DISTINCT FROM d.technologie
+            AND o.occurrences <= 0;
+        """)
+
+        # Recalcul exact des compteurs suivis (dont cloud_count) sur les technos réécrites
+        reconcile_techno_counts(cursor)
+        conn.commit()
+    finally:
+        conn.rollback()
+        release_maintenance_lock(conn, exclusive=True)
+
+
+# Arguments de la ligne de commande
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Nettoyage de la base de données après ajout ou retrait d'une technologie des listes")
+    parser.add_argument('--workers',
+                        type=int,
+                        default=int(os.environ.get('CLEANING_WORKERS', 1)),
+                        help="Nombre de processus pour l'extraction des technos (variable CLEANING_WORKERS, 1 par défaut)")
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=int(os.environ.get('CLEANING_CHUNK_SIZE', 2000)),
+                        help="Nombre d'annonces par paquet envoyé aux processus")
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help="Lit jobs par paquets via un curseur côté serveur et copie chaque paquet dans jobs_temp, le cache des technos reste dans la base (mémoire bornée, hors index TOKEN_INDEX_PATH)")
+    parser.add_argument('--batch-size',
+                        type=int,
+                        default=int(os.environ.get('CLEANING_BATCH_SIZE', 10000)),
+                        help="Nombre d'annonces par paquet en mode --stream")
+    parser.add_argument('--checkpoint-size',
+                        type=int,
+                        default=int(os.environ.get('CLEANING_CHECKPOINT_SIZE', 100000)),
+                        help="Largeur (en id) des tranches de la reconstruction, chacune enregistrée comme point de reprise")
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help="Reprend une reconstruction interrompue : les tranches déjà chargées dans jobs_temp ne sont pas refaites")
+    parser.add_argument('--occurrences-in-db',
+                        action='store_true',
+                        help="Reconstruit jobsoccurrences par une requête GROUP BY dans la base plutôt qu'en pandas")
+    parser.add_argument('--diff',
+                        action='store_true',
+                        help="Relit toutes les descriptions mais ne met à jour que les annonces dont les technos changent")
+    parser.add_argument('--incremental',
+                        action='store_true',
+                        help="Ne relit que les annonces concernées par les technos ajoutées ou retirées (index TOKEN_INDEX_PATH)")
+    parser.add_argument('--lock-timeout',
+                        type=int,
+                        default=int(os.environ.get('MAINTENANCE_LOCK_TIMEOUT', 600)),
+                        help="Attente maximale, en secondes, du verrou de maintenance avant abandon (variable MAINTENANCE_LOCK_TIMEOUT)")
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_arguments()
+
+    database, user, password, host, port = get_secret()
+
+    # Création de la connexion psycopg2 pour récupérer les listes
+    conn = psycopg2.connect(database=database, 
+                            user=user, 
+                            password=password, 
+                            host=host, 
+                            port=port)
+    cursor = conn.cursor() 
+
+    # Pas de verrou pendant la lecture et l'extraction : les Lambdas de nettoyage continuent d'écrire
+    # Le verrou exclusif n'est pris qu'autour de l'écriture des résultats (remplacement des tables ou mise à jour)
 
-    jobsoccurrences_dataframe.to_csv(os.environ['JOBSOCCURRENCE_FILE_PATH'], index=False)
-    time.sleep(5)
+    # --------------------------------------------
+    # ------ Récupération des listes en BDD ------
+    # --------------------------------------------
 
-    # Copier les données depuis le fichier CSV en utilisant copy_expert
-    with open(os.environ['JOBSOCCURRENCE_FILE_PATH'], 'r') as f:
-        # Utiliser la méthode copy_expert pour copier les données depuis le fichier CSV
-        cursor.copy_expert(sql.SQL("COPY {} FROM STDIN WITH CSV HEADER").format(
-            sql.Identifier('jobsoccurrences_temp')), f)
-        # Fermer le fichier
-        f.close()
+    # Dictionnaire des technos (tables techno_pattern / techno_canonical / techno_alias)
+    # La table lists est réimportée au préalable si elle a changé depuis le dernier import
+    sync_dictionary(conn, cursor)
+    dictionary = load_dictionary(cursor)
+    techno_list, mini_list, techno_dict = dictionary.techno_list, dictionary.mini_list, dictionary.techno_dict
 
-    conn.commit()
 
-    # Remplacement de la table originelle
-    cursor.execute("""
-    ALTER TABLE jobsoccurrences
-    RENAME TO jobsoccurrences_to_delete;
-    """)
-    conn.commit()
+    # Cache des technos déjà extraites pour cette version du dictionnaire
+    # En mode --stream, il n'est pas chargé en entier : chaque paquet lit ses propres entrées
+    version = str(dictionary.version)
+    techno_cache = load_techno_cache(conn, cursor, version, preload=not args.stream)
 
-    cursor.execute("""
-    ALTER TABLE jobsoccurrences_temp
-    RENAME TO jobsoccurrences;
-    """)
-    conn.commit()
+
+    # --------------------------------------------------
+    # ------ Déclaration de l'état de maintenance ------
+    # --------------------------------------------------
 
     cursor.execute("""
-    DROP TABLE jobsoccurrences_to_delete;
+        UPDATE maintenance 
+        SET status = 'maintenance';
     """)
     conn.commit()
 
 
+    # Chargement de l'index inversé des descriptions (fichier local), nécessaire au mode incrémental
+    token_index = TokenIndex.load(os.environ.get('TOKEN_INDEX_PATH'))
+
+    if args.incremental and (token_index is None or token_index.lists is None):
+        print("Mode incrémental impossible sans index, lancement d'une reconstruction complète")
+
+    # Recherche des technos : recherche dans la description puis nettoyage (nom correct + suppression des doublons)
+    # Avec --workers > 1, les annonces sont réparties par paquets sur plusieurs processus, l'ordre des id est conservé
+    # Le pool est créé une seule fois, les outils de recherche sont construits au démarrage de chaque worker
+    technology_finder = build_technology_finder(techno_list, mini_list)
+    alias_map = build_alias_map(techno_dict)
+    extraction_pool = create_extraction_pool(techno_list, mini_list, techno_dict, args.workers)
+
+    def extract(descriptions):
+        return extract_technos_parallel(descriptions, technology_finder, alias_map, extraction_pool, args.chunk_size)
+
+    try:
+        if args.incremental and token_index is not None and token_index.lists is not None:
+            incremental_update(conn, cursor, token_index, techno_list, mini_list, techno_dict, extract, version, techno_cache, args.lock_timeout)
+        else:
+            # La lecture de jobs se fait sur une seconde connexion, pendant que la première écrit
+            read_conn = psycopg2.connect(database=database, 
+                                         user=user, 
+                                         password=password, 
+                                         host=host, 
+                                         port=port)
+            try:
+                if args.diff:
+                    # L'index existant reste valable (les descriptions ne changent pas), il est seulement complété
+                    diff_update(conn, cursor, read_conn, extract, version, techno_cache, args)
+                    if token_index is not None:
+                        cursor.execute("SELECT id, description FROM jobs WHERE id > %s", (token_index.max_id,))
+                        new_jobs = pd.DataFrame(cursor.fetchall(), columns=['id', 'description'])
+                        token_index.add(new_jobs['id'], new_jobs['description'])
+                        conn.commit()
+                else:
+                    # L'index est reconstruit à partir des descriptions lues pendant la reconstruction (si TOKEN_INDEX_PATH est défini)
+                    token_index = full_rebuild(conn, cursor, read_conn, extract, version, techno_cache, args)
+            finally:
+                read_conn.close()
+    except MaintenanceLockTimeout as e:
+        # Aucune modification écrite : l'index n'est pas sauvegardé, les listes seront retraitées à la prochaine exécution
+        print(f'{e}, abandon sans modification de jobs')
+        token_index = None
+    finally:
+        if extraction_pool is not None:
+            extraction_pool.shutdown()
+
+    # Sauvegarde de l'index et des listes utilisées pour la prochaine exécution incrémentale
+    if os.environ.get('TOKEN_INDEX_PATH') and token_index is not None:
+        token_index.lists = (techno_list, mini_list, techno_dict)
+        token_index.save(os.environ['TOKEN_INDEX_PATH'])
+
+
     # -----------------------------------------------------
     # ------ Déclaration de la fin de la maintenance ------
     # -----------------------------------------------------
@@ -356,5 +689,6 @@ else:
     conn.commit()
     conn.close()
 
-    os.remove(os.environ['JOBSOCCURRENCE_FILE_PATH'])
-    os.remove(os.environ['JOBS_FILE_PATH'])
\ No newline at end of file
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+from psycopg2 import sql
+
+
+# ------------------------------------------------------------
+# ------ Points de reprise de la reconstruction de jobs ------
+# ------------------------------------------------------------
+
+# La reconstruction est découpée en tranches d'id [range_start, range_end)
+# Chaque tranche copiée dans la table fantôme est enregistrée dans maintenance_checkpoint, dans la même transaction
+# que la copie : une tranche enregistrée est donc toujours entièrement chargée
+# Les points de reprise sont liés à la version des listes, un changement de listes impose de tout reprendre
+
+
+# Découpage des id de la table en tranches alignées sur des multiples de range_size
+# Les bornes des tranches restent les mêmes d'une exécution à l'autre (seule la dernière s'allonge si des annonces
+# ont été ajoutées entre-temps), ce qui permet de reconnaître les tranches déjà traitées
+def id_ranges(cursor, table_name, range_size):
+    cursor.execute(sql.SQL("SELECT MIN(id), MAX(id) FROM {}").format(sql.Identifier(table_name)))
+    min_id, max_id = cursor.fetchone()
+    if min_id is None:
+        return []
+
+    first_start = (min_id // range_size) * range_size
+    return [(start, min(start + range_size, max_id + 1)) for start in range(first_start, max_id + 1, range_size)]
+
+
+# Tranches déjà traitées pour cette version des listes et cette table fantôme
+# Sans table fantôme (supprimée ou jamais créée), il n'y a rien à reprendre
+def load_checkpoints(conn, cursor, version, shadow_name):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS maintenance_checkpoint (
+            range_start BIGINT,
+            range_end BIGINT,
+            version VARCHAR(40),
+            completed_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (range_start, range_end)
+        );
+    """)
+    cursor.execute("SELECT to_regclass(%s)", (shadow_name,))
+    shadow_exists = cursor.fetchone()[0] is not None
+
+    cursor.execute("SELECT range_start, range_end FROM maintenance_checkpoint WHERE version = %s", (version,))
+    completed = set(cursor.fetchall()) if shadow_exists else set()
+    conn.commit()
+    return completed
+
+
+# Enregistrement d'une tranche terminée (validé avec la transaction en cours, celle de la copie)
+def record_checkpoint(cursor, version, id_range):
+    cursor.execute("""
+        INSERT INTO maintenance_checkpoint (range_start, range_end, version)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (range_start, range_end) DO UPDATE SET version = EXCLUDED.version, completed_at = NOW()
+    """, (*id_range, version))
+
+
+# Suppression des points de reprise : au début d'une reconstruction sans reprise, et après le remplacement des tables
+def clear_checkpoints(conn, cursor):
+    cursor.execute("DELETE FROM maintenance_checkpoint")
+    conn.commit()
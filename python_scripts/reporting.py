@@ -106,7 +106,9 @@ cursor.execute("""
         occurrences,
         daily_job_scrap,
         lambda_status,
-        cities_to_add
+        cities_to_add,
+        duplicate_jobs,
+        batch_duplicate_rate
     FROM reporting
     WHERE reporting_date = %s
     ORDER BY ID ASC
@@ -120,7 +122,9 @@ result_df = pd.DataFrame(cursor.fetchall(), columns=['Date de rapport',
                                                      "Cumul occurrences journalières ajoutées",
                                                      "Total de métiers scrapés pour la journée",
                                                      "Lambda status",
-                                                     "Villes à ajouter"])
+                                                     "Villes à ajouter",
+                                                     "Annonces en doublon ignorées",
+                                                     "Part de doublons dans le fichier"])
 
 
 # Fonction pour créer le corps de l'e-mail à partir du dataframe
@@ -137,6 +141,8 @@ def create_email_body(df, report_date):
         body += f"    - Webscraping status: {row['Webscraping status']}\n"
         body += f"    - Cumul occurrences journalières ajoutées: {row['Cumul occurrences journalières ajoutées']}\n"
         body += f"    - Total de métiers réellement ajoutés: {row['Total de métiers scrapés pour la journée']}\n"
+        body += f"    - Annonces en doublon ignorées: {row['Annonces en doublon ignorées']}\n"
+        body += f"    - Part de doublons dans le fichier: {row['Part de doublons dans le fichier']:.1%}\n"
         body += f"    - Status de la Lambda function: {row['Lambda status']}\n"
         body += f"    - Villes à ajouter: {row['Villes à ajouter']}\n\n"
 
@@ -0,0 +1,206 @@
+from botocore.exceptions import ClientError
+import psycopg2
+import argparse
+import json
+import boto3
+import os
+import sys
+
+# Le verrou de maintenance, le dictionnaire des technos et les compteurs sont partagés avec la Lambda de nettoyage
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+
+from maintenance_lock import MaintenanceLockTimeout, acquire_maintenance_lock, release_maintenance_lock
+from techno_counters import TECHNO_COUNT_TABLE, reconcile_techno_counts
+from techno_dictionary import DICTIONARY_TABLES, sync_dictionary
+
+# Récupération des variables d'environnement
+def get_secret():
+
+    secret_name_1 = os.environ['SECRET_NAME_1']
+    region_name = os.environ['SECRET_REGION_NAME']
+
+    # Create a Secrets Manager client
+    session = boto3.session.Session()
+    client = session.client(
+        service_name='secretsmanager',
+        region_name=region_name
+    )
+
+    try:
+        get_secret_value_response_1 = client.get_secret_value(
+            SecretId=secret_name_1
+        )
+    except ClientError as e:
+        raise e
+
+
+    secret_1 = get_secret_value_response_1['SecretString']
+    secret_dict_1 = json.loads(secret_1)
+
+    # Retrieve specific variables (e.g., username and password)
+    database = secret_dict_1.get('dbInstanceIdentifier')
+    user = secret_dict_1.get('username')
+    password = secret_dict_1.get('password')
+    host = secret_dict_1.get('host')
+    port = secret_dict_1.get('port')
+
+    return database, user, password, host, port
+
+
+# ----------------------------------
+# ------ Migrations du schéma ------
+# ----------------------------------
+
+# Changements de schéma à faire une seule fois, avant le déploiement du code qui en dépend
+# La Lambda de nettoyage et les scripts supposent ensuite que le schéma existe
+# Chaque migration est idempotente (IF NOT EXISTS, ...) : le script peut être relancé sans risque
+
+
+# Tables du dictionnaire des technos, puis premier import de la table lists
+def migrate_techno_dictionary(conn, cursor):
+    cursor.execute(DICTIONARY_TABLES)
+    sync_dictionary(conn, cursor)
+
+
+# Règle de dédoublonnage des annonces (une annonce par entreprise, intitulé, ville et mois) portée par un index
+# unique sur une colonne calculée du mois : la Lambda de nettoyage insère avec ON CONFLICT DO NOTHING
+# Les doublons existants sont supprimés avant la création de l'index (on garde la première annonce, plus petit id)
+def migrate_jobs_month_dedup(conn, cursor):
+
+    # Avant PostgreSQL 15, les NULL sont distincts dans un index unique (contrairement au GROUP BY d'origine)
+    nulls_not_distinct = 'NULLS NOT DISTINCT' if conn.server_version >= 150000 else ''
+
+    cursor.execute("""
+        ALTER TABLE jobs
+        ADD COLUMN IF NOT EXISTS month_key DATE
+        GENERATED ALWAYS AS (DATE_TRUNC('month', date_of_search::timestamp)::date) STORED
+    """)
+    cursor.execute("""
+        DELETE FROM jobs
+        WHERE id NOT IN (
+            SELECT MIN(id)
+            FROM jobs
+            GROUP BY job_name, company_name, city_name, month_key)
+    """)
+    cursor.execute(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS jobs_month_dedup
+        ON jobs (job_name, company_name, city_name, month_key) {nulls_not_distinct}
+    """)
+
+    # Nombre d'annonces écartées en doublon, alimenté par la Lambda de nettoyage et envoyé dans le reporting
+    cursor.execute("ALTER TABLE reporting ADD COLUMN IF NOT EXISTS duplicate_jobs INT DEFAULT 0")
+
+
+# Part des annonces d'un fichier écartées car en double dans le fichier lui-même (reporting)
+def migrate_reporting_batch_duplicate_rate(conn, cursor):
+    cursor.execute("ALTER TABLE reporting ADD COLUMN IF NOT EXISTS batch_duplicate_rate REAL DEFAULT 0")
+
+
+# Une ligne de jobsoccurrences par jour, région, métier et techno : la Lambda de nettoyage y additionne les scraps
+# de la journée par INSERT ... ON CONFLICT DO UPDATE
+# Les lignes existantes d'une même clé sont regroupées (somme des occurrences) avant la création de l'index
+def migrate_jobsoccurrences_day_key(conn, cursor):
+
+    nulls_not_distinct = 'NULLS NOT DISTINCT' if conn.server_version >= 150000 else ''
+
+    cursor.execute("""
+        CREATE TEMP TABLE jobsoccurrences_merged ON COMMIT DROP AS
+        SELECT date_of_search, MIN(day_of_week) AS day_of_week, region, job_search, technologie, SUM(occurrences) AS occurrences
+        FROM jobsoccurrences
+        GROUP BY date_of_search, region, job_search, technologie
+        HAVING COUNT(*) > 1;
+
+        DELETE FROM jobsoccurrences o
+        USING jobsoccurrences_merged m
+        WHERE o.date_of_search = m.date_of_search
+        AND o.region IS NOT DISTINCT FROM m.region
+        AND o.job_search IS NOT DISTINCT FROM m.job_search
+        AND o.technologie IS NOT DISTINCT FROM m.technologie;
+
+        INSERT INTO jobsoccurrences (date_of_search, day_of_week, region, job_search, technologie, occurrences)
+        SELECT date_of_search, day_of_week, region, job_search, technologie, occurrences
+        FROM jobsoccurrences_merged;
+    """)
+    cursor.execute(f"""
+        CREATE UNIQUE INDEX IF NOT EXISTS jobsoccurrences_day_key
+        ON jobsoccurrences (date_of_search, region, job_search, technologie) {nulls_not_distinct}
+    """)
+
+
+# Compteurs d'annonces par techno suivie (AWS, GCP et Azure sous 'cloud' au départ), incrémentés par la Lambda
+# Ils sont calculés une fois sur toute la table et cloud_count repart de leur somme : les incréments suivants
+# s'appliquent ainsi à un total exact, et non à l'ancien comptage par LIKE
+def migrate_techno_count(conn, cursor):
+    cursor.execute(TECHNO_COUNT_TABLE)
+    reconcile_techno_counts(cursor)
+
+
+# Résolutions de villes mémorisées par la Lambda de nettoyage, par version des règles et de reg_dep_com.csv
+# created_at date l'écriture de chaque résolution : python_scripts/city_error.py garde la version la plus récente
+def migrate_city_resolution(conn, cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS city_resolution (
+            city_name TEXT,
+            version CHAR(40),
+            city VARCHAR(120),
+            region VARCHAR(120),
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (city_name, version)
+        );
+    """)
+
+
+# Migrations dans leur ordre d'application
+MIGRATIONS = [migrate_techno_dictionary,
+              migrate_jobs_month_dedup,
+              migrate_reporting_batch_duplicate_rate,
+              migrate_jobsoccurrences_day_key,
+              migrate_techno_count,
+              migrate_city_resolution]
+
+
+# Arguments de la ligne de commande
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Migration du schéma de la base de données, sous verrou de maintenance exclusif")
+    parser.add_argument('--lock-timeout',
+                        type=int,
+                        default=int(os.environ.get('MAINTENANCE_LOCK_TIMEOUT', 600)),
+                        help="Attente maximale, en secondes, du verrou de maintenance avant abandon (variable MAINTENANCE_LOCK_TIMEOUT)")
+    return parser.parse_args()
+
+
+def main():
+
+    args = parse_arguments()
+
+    database, user, password, host, port = get_secret()
+
+    conn = psycopg2.connect(database=database,
+                            user=user,
+                            password=password,
+                            host=host,
+                            port=port)
+    cursor = conn.cursor()
+
+    # Les migrations modifient des tables lues et écrites par les Lambdas de nettoyage : on attend la fin de
+    # celles en cours et on bloque les suivantes jusqu'à la fin des migrations
+    try:
+        acquire_maintenance_lock(conn, exclusive=True, timeout=args.lock_timeout)
+    except MaintenanceLockTimeout as e:
+        print(f'{e}, migration abandonnée')
+        conn.close()
+        return
+
+    try:
+        for migration in MIGRATIONS:
+            print(f'Migration : {migration.__name__}')
+            migration(conn, cursor)
+            conn.commit()
+    finally:
+        conn.rollback()
+        release_maintenance_lock(conn, exclusive=True)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
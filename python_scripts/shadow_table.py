@@ -0,0 +1,107 @@
+from psycopg2 import sql
+import re
+
+
+# ------------------------------------------------------------
+# ------ Table fantôme : copie, chargement puis échange ------
+# ------------------------------------------------------------
+
+# Création de la table fantôme avec la même définition que la table de production
+# (colonnes, valeurs par défaut, contraintes CHECK, stockage), sans les index : ils sont créés après le chargement
+def create_shadow_table(conn, cursor, table_name, shadow_name):
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(shadow_name)))
+    cursor.execute(sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING ALL EXCLUDING INDEXES)").format(
+        sql.Identifier(shadow_name),
+        sql.Identifier(table_name)))
+    conn.commit()
+
+
+# Recréation sur la table fantôme des index (et contraintes PRIMARY KEY / UNIQUE) de la table de production
+# Les index sont créés sous un nom temporaire, retourne les renommages à faire une fois l'ancienne table supprimée
+# Ceux laissés par une exécution interrompue (reprise) sont d'abord supprimés
+def build_shadow_indexes(conn, cursor, table_name, shadow_name):
+    cursor.execute("""
+        SELECT index_class.relname, pg_get_indexdef(index_class.oid), constraint_def.conname, constraint_def.contype
+        FROM pg_index
+        JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+        LEFT JOIN pg_constraint constraint_def ON constraint_def.conindid = pg_index.indexrelid
+            AND constraint_def.conrelid = pg_index.indrelid
+        WHERE pg_index.indrelid = %s::regclass
+    """, (table_name,))
+
+    renames = []
+    for index_name, index_definition, constraint_name, constraint_type in cursor.fetchall():
+        shadow_index = f'{index_name}_swap'
+
+        if constraint_type in ('p', 'u'):
+            cursor.execute(sql.SQL("ALTER TABLE {} DROP CONSTRAINT IF EXISTS {}").format(
+                sql.Identifier(shadow_name),
+                sql.Identifier(f'{constraint_name}_swap')))
+        cursor.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(shadow_index)))
+
+        # CREATE [UNIQUE] INDEX nom ON [ONLY] schema.table USING ... -> même index sur la table fantôme
+        shadow_definition = re.sub(r'^(CREATE (?:UNIQUE )?INDEX )\S+( ON (?:ONLY )?)\S+',
+                                   lambda match: f'{match.group(1)}{shadow_index}{match.group(2)}{shadow_name}',
+                                   index_definition)
+        cursor.execute(shadow_definition)
+
+        if constraint_type in ('p', 'u'):
+            # L'index devient la contrainte (et prend son nom)
+            cursor.execute(sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {} USING INDEX {}").format(
+                sql.Identifier(shadow_name),
+                sql.Identifier(f'{constraint_name}_swap'),
+                sql.SQL('PRIMARY KEY' if constraint_type == 'p' else 'UNIQUE'),
+                sql.Identifier(shadow_index)))
+            renames.append((f'{constraint_name}_swap', constraint_name))
+        else:
+            renames.append((shadow_index, index_name))
+
+    conn.commit()
+    return renames
+
+
+# Statistiques du planificateur puis remplacement des tables de production, en une seule transaction
+# swaps : liste de (table de production, table fantôme, renommages retournés par build_shadow_indexes)
+# Personne ne voit d'état intermédiaire : les tables sont remplacées et leurs index renommés d'un coup
+# before_swap (optionnel) est appelée dans cette même transaction, avant les renommages : ses modifications
+# des tables fantômes ne sont validées qu'avec l'échange
+def swap_shadow_tables(conn, cursor, swaps, before_swap=None):
+    for table_name, shadow_name, renames in swaps:
+        cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(shadow_name)))
+    conn.commit()
+
+    if before_swap is not None:
+        before_swap()
+
+    for table_name, shadow_name, renames in swaps:
+        old_name = f'{table_name}_to_delete'
+
+        cursor.execute(sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE").format(sql.Identifier(table_name)))
+
+        # Séquence de la colonne id s'il y en a une (jobs), aucune ligne pour jobsoccurrences
+        cursor.execute("""
+            SELECT pg_get_serial_sequence(%s, attname)
+            FROM pg_attribute
+            WHERE attrelid = %s::regclass
+            AND attname = 'id'
+            AND NOT attisdropped
+        """, (table_name, table_name))
+        sequence_row = cursor.fetchone()
+        sequence_name = sequence_row[0] if sequence_row else None
+
+        cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(table_name), sql.Identifier(old_name)))
+        cursor.execute(sql.SQL("ALTER TABLE {} RENAME TO {}").format(sql.Identifier(shadow_name), sql.Identifier(table_name)))
+
+        # La séquence des id est partagée par les deux tables (valeur par défaut copiée) : elle passe à la nouvelle table
+        # avant la suppression de l'ancienne, puis repart du MAX(id) comme auparavant
+        if sequence_name:
+            cursor.execute(sql.SQL("ALTER SEQUENCE {} OWNED BY {}.id").format(sql.SQL(sequence_name), sql.Identifier(table_name)))
+            cursor.execute(sql.SQL("SELECT setval(%s, COALESCE((SELECT MAX(id) FROM {}), 1))").format(sql.Identifier(table_name)), (sequence_name,))
+
+        cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(old_name)))
+
+        # Renommer l'index d'une contrainte renomme aussi la contrainte
+        for temporary_name, final_name in renames:
+            cursor.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(sql.Identifier(temporary_name), sql.Identifier(final_name)))
+
+    conn.commit()
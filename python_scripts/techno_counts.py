@@ -0,0 +1,79 @@
+from botocore.exceptions import ClientError
+import psycopg2
+import json
+import boto3
+import os
+import sys
+
+# Le verrou de maintenance et les compteurs sont partagés avec la Lambda de nettoyage
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+
+from maintenance_lock import MaintenanceLockTimeout, acquire_maintenance_lock, release_maintenance_lock
+from techno_counters import reconcile_techno_counts
+
+
+# Récupération des variables
+def get_secret():
+
+    secret_name_1 = os.environ['SECRET_NAME_1']
+    region_name = os.environ['SECRET_REGION_1']
+
+    # Create a Secrets Manager client
+    session = boto3.session.Session()
+    client = session.client(
+        service_name='secretsmanager',
+        region_name=region_name
+    )
+
+    try:
+        get_secret_value_response_1 = client.get_secret_value(
+            SecretId=secret_name_1
+        )
+    except ClientError as e:
+        raise e
+
+    secret_1 = get_secret_value_response_1['SecretString']
+    secret_dict_1 = json.loads(secret_1)
+
+    # Retrieve specific variables (e.g., username and password)
+    database = secret_dict_1.get('dbInstanceIdentifier')
+    user = secret_dict_1.get('username')
+    password_db = secret_dict_1.get('password')
+    host = secret_dict_1.get('host')
+    port = secret_dict_1.get('port')
+
+    return database, user, password_db, host, port
+
+
+# Recalcul périodique des compteurs d'annonces par techno suivie (techno_count et cloud_count)
+# La Lambda de nettoyage les incrémente fichier par fichier : ce recalcul exact corrige tout écart éventuel
+def main():
+
+    database, user, password, host, port = get_secret()
+
+    conn = psycopg2.connect(database=database,
+                            user=user,
+                            password=password,
+                            host=host,
+                            port=port)
+    cursor = conn.cursor()
+
+    # Verrou exclusif : aucune ingestion ne doit incrémenter les compteurs pendant le recalcul
+    try:
+        acquire_maintenance_lock(conn, exclusive=True, timeout=int(os.environ.get('MAINTENANCE_LOCK_TIMEOUT', 600)))
+    except MaintenanceLockTimeout as e:
+        print(f'{e}, recalcul abandonné')
+        conn.close()
+        return
+
+    try:
+        reconcile_techno_counts(cursor)
+        conn.commit()
+    finally:
+        conn.rollback()
+        release_maintenance_lock(conn, exclusive=True)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import pandas as pd
+import hashlib
+import re
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# pyahocorasick est optionnel : sans lui, technology_finder garde une recherche de sous-chaîne par techno
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+# ----------------------------------------------------
+# ------ Normalisation des technos (clean_list) ------
+# ----------------------------------------------------
+
+# Construit une seule fois la table de correspondance {appellation : nom complet}
+# à partir du dictionnaire clean_list {nom complet : [appellations]}
+# En cas d'appellation présente dans plusieurs clés, la dernière clé l'emporte (même comportement que l'ancienne boucle)
+def build_alias_map(techno_dict):
+    alias_map = {}
+    for canonical, aliases in techno_dict.items():
+        for alias in aliases:
+            alias_map[alias] = canonical
+    return alias_map
+
+
+# Remplace les appellations par le nom complet puis supprime les doublons, sur toute la colonne en une passe
+# La colonne est éclatée (1 ligne par techno), les technos uniques sont résolues via la table de correspondance
+# puis les lignes sont dédoublonnées et regroupées. L'ordre d'apparition des technos est conservé.
+def canonicalize_technos(technos, alias_map):
+    if len(technos) == 0:
+        return technos
+
+    # Index positionnel pour pouvoir regrouper même si l'index d'origine a des doublons
+    exploded = technos.reset_index(drop=True).str.split(', ').explode()
+
+    # Une seule résolution par techno distincte, le map sur un dict complet reste vectorisé
+    lookup = {techno: alias_map.get(techno, techno) for techno in exploded.unique()}
+
+    frame = pd.DataFrame({'row': exploded.index, 'techno': exploded.map(lookup).values})
+    frame = frame.drop_duplicates()
+    joined = frame.groupby('row', sort=True)['techno'].agg(', '.join)
+
+    return pd.Series(joined.values, index=technos.index, name=technos.name)
+
+
+# -------------------------------------------------------
+# ------ Recherche des technos dans la description ------
+# -------------------------------------------------------
+
+# Automate d'Aho-Corasick (pyahocorasick, en C) : toutes les technos de techno_list sont cherchées
+# en un seul parcours du texte au lieu d'une recherche de sous-chaîne par techno
+def build_techno_automaton(techno_list):
+    automaton = ahocorasick.Automaton()
+    for techno in set(techno_list):
+        if techno:
+            automaton.add_word(techno, techno)
+    automaton.make_automaton()
+    return automaton
+
+
+# Construit la fonction de recherche des technos à partir des listes en BDD
+# L'automate est compilé une seule fois, la fonction retournée est appliquée à chaque description
+def build_technology_finder(techno_list, mini_list):
+    # Sans pyahocorasick (ou sans techno à chercher), recherche de sous-chaîne par techno
+    # La description sans espace n'est calculée qu'une fois, et non plus pour chaque techno
+    if ahocorasick is None or not any(techno_list):
+        def find_technos(compact):
+            return [i for i in techno_list if i in compact]
+    else:
+        automaton = build_techno_automaton(techno_list)
+
+        # Une techno vide est toujours présente dans la description (même comportement que "'' in description")
+        always_found = {''} if '' in techno_list else set()
+
+        def find_technos(compact):
+            found = {techno for _, techno in automaton.iter(compact)} | always_found
+            return [i for i in techno_list if i in found]
+
+    # Les mots de 4 lettres et moins doivent être entourés d'espaces (ou début / fin de texte)
+    # Sans espace dans le mot, c'est exactement "le mot est un des tokens de description.split()"
+    mini_tokens = frozenset(mot for mot in mini_list if mot and not any(char.isspace() for char in mot))
+
+    # Les cas restants (mot vide ou contenant un espace) gardent le Regex d'origine, compilé une seule fois
+    # re.escape permet de ne pas prendre en compte les caractères spéciaux, sinon erreur de code
+    mini_patterns = {mot: re.compile(r'(?<!\S){}(?!\S)'.format(re.escape(mot)))
+                     for mot in mini_list if mot not in mini_tokens}
+
+    def technology_finder(description):
+        # Récupération des technos dans la description (ordre et doublons de techno_list conservés)
+        technos = find_technos(description.replace(' ', ''))
+
+        # Les mots de 4 lettres et moins sont récupérés par intersection avec les tokens de la description
+        tokens = mini_tokens.intersection(description.split())
+        for mot in mini_list:
+            if mot in tokens or (mot in mini_patterns and mini_patterns[mot].search(description)):
+                technos.append(mot)
+
+        # On joint les deux listes de technos en une seule
+        return ', '.join(technos)
+
+    return technology_finder
+
+
+# -----------------------------------------------------
+# ------ Extraction des technos sur un DataFrame ------
+# -----------------------------------------------------
+
+# Recherche des technos dans chaque description puis nettoyage (nom correct + suppression des doublons)
+def extract_technos(descriptions, technology_finder, alias_map):
+    technos = descriptions.apply(technology_finder)
+    return canonicalize_technos(technos, alias_map)
+
+
+# Outils de recherche propres à chaque processus, construits une seule fois au démarrage du worker
+worker_matchers = None
+
+
+def init_extraction_worker(techno_list, mini_list, techno_dict):
+    global worker_matchers
+    worker_matchers = (build_technology_finder(techno_list, mini_list), build_alias_map(techno_dict))
+
+
+def extract_technos_chunk(descriptions):
+    technology_finder, alias_map = worker_matchers
+    return extract_technos(descriptions, technology_finder, alias_map)
+
+
+# Pool de processus de l'extraction, créé une seule fois par exécution puis passé à extract_technos_parallel
+# Les listes ne sont transmises qu'une fois par worker (initializer), qui construit ses outils de recherche au démarrage
+# Les workers sont lancés par un serveur forkserver et non par fork : le premier map peut partir d'un thread
+# (producteur du COPY) et un fork hériterait des verrous et des connexions du processus principal
+# Avec un seul worker, pas de pool : l'extraction se fait dans le processus principal
+def create_extraction_pool(techno_list, mini_list, techno_dict, workers):
+    if workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context('forkserver'),
+                               initializer=init_extraction_worker,
+                               initargs=(techno_list, mini_list, techno_dict))
+
+
+# Découpe les descriptions en paquets envoyés au pool de processus
+# pool.map conserve l'ordre des paquets : le résultat est dans le même ordre que l'entrée
+def extract_technos_parallel(descriptions, technology_finder, alias_map, pool=None, chunk_size=2000):
+    if pool is None or len(descriptions) <= chunk_size:
+        return extract_technos(descriptions, technology_finder, alias_map)
+
+    chunks = [descriptions.iloc[start:start + chunk_size] for start in range(0, len(descriptions), chunk_size)]
+    return pd.concat(list(pool.map(extract_technos_chunk, chunks)))
+
+
+# -----------------------------------------------
+# ------ Cache des technos par description ------
+# -----------------------------------------------
+
+# Le cache est indexé par la version du dictionnaire (lambda_functions/techno_dictionary.py) :
+# toute modification du dictionnaire invalide les entrées précédentes
+
+def description_hash(description):
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+# Technos des descriptions en passant par le cache {hash de la description : technos}
+# Seules les descriptions absentes du cache sont traitées par extract, une seule fois par description distincte
+# Le cache est complété et les nouvelles entrées sont retournées pour être enregistrées en base
+def extract_technos_cached(descriptions, cache, extract):
+    hashes = descriptions.map(description_hash)
+    missing = ~hashes.isin(cache.keys())
+
+    new_entries = {}
+    if missing.any():
+        unique_missing = ~hashes.duplicated() & missing
+        new_technos = extract(descriptions[unique_missing])
+        new_entries = dict(zip(hashes[unique_missing].values, new_technos.values))
+        cache.update(new_entries)
+
+    return hashes.map(cache), new_entries
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pickle
+import os
+
+from techno_matching import build_alias_map
+
+
+# -----------------------------------------------------
+# ------ Index inversé {token : id des annonces} ------
+# -----------------------------------------------------
+
+# Permet de retrouver les annonces concernées par l'ajout ou le retrait d'une techno sans relire toutes les descriptions
+# Les tokens sont ceux de description.split(), les id de chaque token sont stockés dans un tableau numpy trié
+# L'index garde aussi les listes utilisées lors de la dernière exécution pour calculer ce qui a changé
+class TokenIndex:
+
+    def __init__(self):
+        self.postings = {}
+        self.max_id = 0
+        self.lists = None
+
+    # Ajout d'annonces à l'index (ids et descriptions sont deux Series alignées)
+    def add(self, ids, descriptions):
+        if len(ids) == 0:
+            return
+
+        frame = pd.DataFrame({'job_id': ids.values, 'token': descriptions.fillna('').str.split().values})
+        frame = frame.explode('token').dropna().drop_duplicates().sort_values(['token', 'job_id'])
+
+        tokens, starts = np.unique(frame['token'].values, return_index=True)
+        for token, job_ids in zip(tokens, np.split(frame['job_id'].values.astype(np.int64), starts[1:])):
+            existing = self.postings.get(token)
+            self.postings[token] = job_ids if existing is None else np.union1d(existing, job_ids)
+
+        self.max_id = max(self.max_id, int(ids.max()))
+
+    # Annonces pouvant contenir une techno de techno_list (recherche de sous-chaîne sur la description sans espaces)
+    # Une occurrence commence dans un token : soit elle y est entière, soit le token finit par un début de la techno
+    # Retourne None si toutes les annonces sont potentiellement concernées
+    def substring_candidates(self, techno):
+        if not techno or any(char.isspace() and char != ' ' for char in techno):
+            return None
+        if ' ' in techno:
+            return np.array([], dtype=np.int64)
+
+        prefixes = tuple(techno[:size] for size in range(1, len(techno)))
+        matches = [job_ids for token, job_ids in self.postings.items()
+                   if techno in token or (prefixes and token.endswith(prefixes))]
+        return np.unique(np.concatenate(matches)) if matches else np.array([], dtype=np.int64)
+
+    # Annonces pouvant contenir une techno de mini_list (mot entouré d'espaces)
+    def token_candidates(self, mot):
+        if not mot or any(char.isspace() for char in mot):
+            return None
+        return self.postings.get(mot, np.array([], dtype=np.int64))
+
+    # Union des annonces concernées par les technos modifiées, None si toutes les annonces le sont
+    def candidates(self, changed_techno, changed_mini):
+        matches = [self.substring_candidates(techno) for techno in changed_techno]
+        matches += [self.token_candidates(mot) for mot in changed_mini]
+
+        if any(job_ids is None for job_ids in matches):
+            return None
+        return np.unique(np.concatenate(matches)) if matches else np.array([], dtype=np.int64)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path):
+        if not path or not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+
+# Technos dont le résultat peut changer entre deux versions des listes
+# Ajouts / retraits dans techno_list et mini_list, plus les appellations dont le nom complet a changé dans clean_list
+def changed_technos(old_lists, new_lists):
+    old_techno, old_mini, old_dict = old_lists
+    new_techno, new_mini, new_dict = new_lists
+
+    changed_techno = set(old_techno) ^ set(new_techno)
+    changed_mini = set(old_mini) ^ set(new_mini)
+
+    old_map, new_map = build_alias_map(old_dict), build_alias_map(new_dict)
+    for alias in set(old_map) | set(new_map):
+        if old_map.get(alias, alias) != new_map.get(alias, alias):
+            if alias in old_techno or alias in new_techno:
+                changed_techno.add(alias)
+            if alias in old_mini or alias in new_mini:
+                changed_mini.add(alias)
+
+    return changed_techno, changed_mini
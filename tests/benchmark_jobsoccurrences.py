@@ -0,0 +1,67 @@
+import pandas as pd
+import psycopg2
+import time
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python_scripts'))
+
+from database_cleaning import count_occurrences, insert_occurrences_from_jobs
+
+# Compare la reconstruction de jobsoccurrences en pandas (lecture de jobs + explode + groupby)
+# avec l'agrégation réalisée dans la base (string_to_array + unnest + GROUP BY)
+# Rien n'est modifié en base : la version SQL écrit dans une table temporaire
+
+conn = psycopg2.connect(database=os.environ['RDS_DATABASE'],
+                        user=os.environ['RDS_USER'],
+                        password=os.environ['RDS_PASSWORD'],
+                        host=os.environ['RDS_ENDPOINT'],
+                        port=os.environ['RDS_PORT'])
+
+print('Connexion OK')
+
+cursor = conn.cursor()
+key_columns = ['date_of_search', 'day_of_week', 'region', 'job_search', 'technologie']
+
+# ------ Version pandas ------
+start = time.perf_counter()
+# Toutes les annonces, y compris sans technos : en reconstruction, technos vide devient NULL au COPY dans jobs_temp
+cursor.execute("SELECT date_of_search, day_of_week, region, job_search, technos FROM jobs")
+jobs_dataframe = pd.DataFrame(cursor.fetchall(), columns=['date_of_search', 'day_of_week', 'region', 'job_search', 'technos'])
+jobs_dataframe['technos'] = jobs_dataframe['technos'].fillna('')
+pandas_occurrences = count_occurrences(jobs_dataframe)
+
+# La techno vide est écrite NULL par le COPY de jobsoccurrences_temp
+pandas_occurrences['technologie'] = pandas_occurrences['technologie'].replace('', None)
+pandas_duration = time.perf_counter() - start
+
+# ------ Version SQL ------
+cursor.execute("""
+    CREATE TEMP TABLE jobsoccurrences_benchmark (
+        date_of_search DATE,
+        day_of_week VARCHAR(20),
+        region VARCHAR(120),
+        job_search VARCHAR(30),
+        technologie VARCHAR(120),
+        occurrences INT
+    );
+""")
+start = time.perf_counter()
+insert_occurrences_from_jobs(cursor, 'jobs', 'jobsoccurrences_benchmark')
+sql_duration = time.perf_counter() - start
+
+cursor.execute(f"SELECT {', '.join(key_columns)}, occurrences FROM jobsoccurrences_benchmark")
+sql_occurrences = pd.DataFrame(cursor.fetchall(), columns=key_columns + ['occurrences'])
+
+# ------ Comparaison ------
+pandas_occurrences = pandas_occurrences.astype(str).sort_values(key_columns).reset_index(drop=True)
+sql_occurrences = sql_occurrences.astype(str).sort_values(key_columns).reset_index(drop=True)
+identical = pandas_occurrences.equals(sql_occurrences)
+
+print(f'Lignes jobs : {len(jobs_dataframe)}, lignes jobsoccurrences : {len(pandas_occurrences)}')
+print(f'pandas : {pandas_duration:.2f} s')
+print(f'SQL    : {sql_duration:.2f} s')
+print(f'Résultats identiques : {identical}')
+
+conn.rollback()
+conn.close()
@@ -0,0 +1,60 @@
+import random
+import re
+import time
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python_scripts'))
+
+import techno_matching
+from techno_matching import build_technology_finder
+
+# Compare la recherche des technos d'origine (une sous-chaîne par techno, description recalculée à chaque fois)
+# avec build_technology_finder, avec et sans pyahocorasick
+# Listes et descriptions générées : 150 technos, descriptions d'environ 3 000 caractères
+# mini_list est vide pour ne mesurer que la recherche des technos de techno_list
+
+rng = random.Random(1)
+alphabet = 'abcdefghijklmnopqrstuvwxyz'
+techno_list = sorted({''.join(rng.choice(alphabet) for _ in range(rng.randint(3, 12))) for _ in range(150)})
+mini_list = []
+words = [''.join(rng.choice(alphabet) for _ in range(rng.randint(2, 10))) for _ in range(3000)] + techno_list
+descriptions = [' '.join(rng.choice(words) for _ in range(450)) for _ in range(500)]
+
+
+# Implémentation d'origine de database_cleaning.py
+def legacy_technology_finder(description):
+    technos = [i for i in techno_list if i in description.replace(' ', '')]
+
+    for mot in mini_list:
+        mot_escaped = re.escape(mot)
+        if re.findall(r'(?<!\S){}(?!\S)'.format(mot_escaped), description):
+            technos.append(mot)
+
+    technos = ', '.join(technos)
+    return technos
+
+
+def benchmark(name, technology_finder):
+    start = time.perf_counter()
+    results = [technology_finder(description) for description in descriptions]
+    duration = time.perf_counter() - start
+    print(f'{name} : {duration * 1000 / len(descriptions):.3f} ms par description')
+    return results
+
+
+print(f'{len(techno_list)} technos, {len(descriptions)} descriptions de {sum(map(len, descriptions)) // len(descriptions)} caractères en moyenne')
+
+legacy_results = benchmark("Version d'origine", legacy_technology_finder)
+
+automaton_module = techno_matching.ahocorasick
+techno_matching.ahocorasick = None
+assert benchmark('Sans pyahocorasick', build_technology_finder(techno_list, mini_list)) == legacy_results
+techno_matching.ahocorasick = automaton_module
+
+if automaton_module is None:
+    print('pyahocorasick non installé')
+else:
+    assert benchmark('Avec pyahocorasick', build_technology_finder(techno_list, mini_list)) == legacy_results
+
+print('SUCCESS')
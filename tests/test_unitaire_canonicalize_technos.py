@@ -0,0 +1,65 @@
+import random
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python_scripts'))
+
+import pandas as pd
+
+from techno_matching import build_alias_map, canonicalize_technos
+
+
+# Dictionnaire représentatif de clean_list (avec une appellation présente dans deux clés : la dernière l'emporte)
+techno_dict = {'Python': ['python', 'python3'],
+               'Spark': ['spark', 'pyspark'],
+               'Power BI': ['powerbi', 'power', 'ms bi'],
+               'AWS': ['aws', '(aws)'],
+               'SQL': ['sql', 'mysql'],
+               'MySQL': ['mysql'],
+               'C++': ['c++']}
+
+
+# Implémentation d'origine de database_cleaning.py (replace_technos + remove_duplicates), utilisée comme référence
+def legacy_replace_technos(row):
+    technos_list = row.split(', ')
+    for index, techno in enumerate(technos_list):
+        for key, value in techno_dict.items():
+            if techno in value:
+                technos_list[index] = key
+    return (', ').join(technos_list)
+
+
+def legacy_remove_duplicates(row):
+    technos_list = row.split(', ')
+    unique_technos = list(set(technos_list))
+    return ', '.join(unique_technos)
+
+
+def random_technos(rng):
+    aliases = [alias for values in techno_dict.values() for alias in values]
+    words = aliases + list(techno_dict) + ['go', 'r', 'tableau', 'docker', '']
+    return ', '.join(rng.choice(words) for _ in range(rng.randint(1, 12)))
+
+
+def test_canonicalize_technos_parity():
+    rng = random.Random(42)
+    technos = pd.Series(['', 'python', 'python, python3', 'mysql, sql', 'aws, (aws), AWS', 'go, r, go']
+                        + [random_technos(rng) for _ in range(2000)],
+                        index=[index % 500 for index in range(2006)])
+
+    result = canonicalize_technos(technos, build_alias_map(techno_dict))
+    legacy = technos.apply(legacy_replace_technos).apply(legacy_remove_duplicates)
+
+    assert result.index.equals(technos.index)
+    for row, expected, original in zip(result, legacy, technos):
+        found = row.split(', ')
+        # L'ancien ordre dépendait de set() : seules les technos retenues sont comparées, sans doublon
+        assert sorted(found) == sorted(expected.split(', ')), original
+        # Le nouvel ordre est celui de la première apparition
+        first_seen = list(dict.fromkeys(legacy_replace_technos(original).split(', ')))
+        assert found == first_seen, original
+
+
+if __name__ == '__main__':
+    test_canonicalize_technos_parity()
+    print('SUCCESS')
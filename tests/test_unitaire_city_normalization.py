@@ -0,0 +1,146 @@
+import random
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda_functions'))
+
+import pandas as pd
+import io
+import tempfile
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from city_normalization import RegionReferenceCache, RegionResolver, load_city_rules, normalize_cities
+
+
+# Chaîne de remplacements d'origine de cleaning_csv_files.py, utilisée comme référence
+def legacy_city(x):
+    return (x.split(',')[0]
+            .strip()
+            .replace('greater', '')
+            .replace('metropolitan', '')
+            .replace('area', '')
+            .replace('region', '')
+            .replace(', france', '')
+            .replace(' et périphérie', '')
+            .replace('ville de', '')
+            .replace('île-de-france', 'paris')
+            .replace('france', 'paris')
+            .replace('la défense', 'puteaux')
+            .strip())
+
+
+def random_city_name(rng):
+    words = ['paris', 'lyon', 'greater', 'metropolitan', 'area', 'region', 'france', 'île-de-france', ', france',
+             ' et périphérie', 'ville de', 'la défense', 'grea', 'ter', 'ile-de-france', 'saint-denis', 'lille', ',', ' ']
+    return ''.join(rng.choice(words) for _ in range(rng.randint(0, 6)))
+
+
+def test_normalize_cities_parity():
+    rng = random.Random(21)
+    city_names = ['', 'paris', 'greater paris metropolitan area', 'île-de-france, france', 'lyon et périphérie',
+                  'ville de marseille', 'la défense', 'puteaux, île-de-france, france', 'greatarear'] + \
+                 [random_city_name(rng) for _ in range(3000)]
+    city_names = pd.Series(city_names, index=range(10, 10 + len(city_names)))
+
+    cities = normalize_cities(city_names, load_city_rules())
+
+    assert cities.index.equals(city_names.index)
+    assert cities.tolist() == [legacy_city(x) for x in city_names]
+
+
+# Extrait de reg_dep_com.csv : communes, départements, chefs-lieux et appellations manuelles
+df_region = pd.DataFrame({
+    'city': ['paris', 'lyon', 'villeurbanne', 'lille', 'puteaux', 'cergy'],
+    'region': ['île-de-france', 'auvergne-rhône-alpes', 'auvergne-rhône-alpes', 'hauts-de-france', 'île-de-france', 'île-de-france'],
+    'region_cheflieu': ['paris', 'lyon', 'lyon', 'lille', 'paris', 'paris'],
+    'departement': ['paris', 'rhône', 'rhône', 'nord', 'hauts-de-seine', "val-d'oise"],
+    'departement_cheflieu': ['paris', 'lyon', 'lyon', 'lille', 'nanterre', 'cergy'],
+    'manual_city': [None, None, 'Villeurbanne Centre', None, 'La Défense', 'Cergy-Pontoise']})
+
+
+# Résolution d'origine de cleaning_csv_files.py (fusions successives), utilisée comme référence
+def legacy_resolve(df, df_region):
+    columns = ['city_name', 'city', 'region']
+    df_region = df_region[~df_region['manual_city'].duplicated()]
+    df = df.merge(df_region, on='city', how='left')[columns]
+
+    df_full_1 = df[~df['region'].isna()]
+    df_empty_1 = df[df['region'].isna()]
+    df_departement = df_region[['departement', 'region']].drop_duplicates()
+    df_empty_1 = df_empty_1.merge(df_departement, left_on='city', right_on='departement', how='left').drop(columns=['region_x']).rename(columns={'region_y': 'region'})
+    df_region_cheflieu = df_region[['region', 'region_cheflieu']].drop_duplicates()
+    df_empty_1 = df_empty_1.merge(df_region_cheflieu, on='region', how='left').drop(columns='city').rename(columns={'region_cheflieu': 'city'})[columns]
+    df = pd.concat([df_full_1, df_empty_1], ignore_index=True)
+
+    df_full_3 = df[~df['region'].isna()]
+    df_empty_3 = df[df['region'].isna()]
+    df_manual_city = df_region[['manual_city', 'city', 'region']].drop_duplicates()
+    df_empty_3 = df_empty_3.drop(columns=['city', 'region']).merge(df_manual_city, left_on='city_name', right_on='manual_city', how='left')[columns]
+    return pd.concat([df_full_3, df_empty_3], ignore_index=True)
+
+
+def test_region_resolver_parity():
+    city_names = pd.Series(['paris', 'Lyon', 'lyon', 'rhône', 'nord', 'La Défense', 'Cergy-Pontoise', 'la défense',
+                            'greater lille area', 'hauts-de-seine', 'Villeurbanne Centre', 'inconnue', 'paris, france', 'lyon'] * 3)
+    df = pd.DataFrame({'city_name': city_names, 'city': normalize_cities(city_names, load_city_rules())})
+
+    expected = legacy_resolve(df.copy(), df_region)
+    df['city'], df['region'] = RegionResolver(df_region).resolve(df['city_name'], df['city'])
+
+    # L'ancienne résolution change l'ordre des lignes, on compare les lignes triées
+    # astype(str) distingue NaN ('nan') de None ('None') : la mise en forme de la Lambda n'écrit NULL que pour NaN
+    resolved = df.astype(str).sort_values(list(df.columns)).reset_index(drop=True)
+    expected = expected.astype(str).sort_values(list(expected.columns)).reset_index(drop=True)
+    assert resolved.values.tolist() == expected.values.tolist()
+
+    # Une ville introuvable vaut NaN (écrite NULL dans jobs), jamais None (écrit 'None' par la mise en forme)
+    for value in RegionResolver(df_region).resolve_one('inconnue', 'Inconnue'):
+        assert value is not None and pd.isna(value)
+
+
+# Client S3 de test : renvoie le fichier, ou 304 si l'ETag transmis est le bon
+class FakeS3:
+
+    def __init__(self, csv, etag='"v1"'):
+        self.csv, self.etag, self.calls = csv, etag, []
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.calls.append(IfNoneMatch)
+        if IfNoneMatch == self.etag:
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'}}, 'GetObject')
+        return {'Body': io.StringIO(self.csv), 'ETag': self.etag}
+
+
+def test_region_reference_cache_revalidation():
+    s3 = FakeS3(df_region.to_csv(index=False))
+    cache = RegionReferenceCache(s3, 'bucket', 'data-files/reg_dep_com.csv', ttl=0)
+
+    resolver = cache.refresh().resolver()
+    assert cache.refresh().resolver() is resolver
+    assert s3.calls == [None, '"v1"']
+
+    # Nouveau fichier sur S3 : nouvelles tables de correspondance
+    s3.etag = '"v2"'
+    assert cache.refresh().etag == '"v2"' and cache.resolver() is not resolver
+
+
+def test_region_reference_cache_local_fallback():
+    class OfflineS3:
+        def get_object(self, **kwargs):
+            raise EndpointConnectionError(endpoint_url='https://s3')
+
+    with tempfile.TemporaryDirectory() as directory:
+        local_path = os.path.join(directory, 'reg_dep_com.csv')
+        df_region.to_csv(local_path, index=False)
+        cache = RegionReferenceCache(OfflineS3(), 'bucket', 'data-files/reg_dep_com.csv', local_path=local_path).refresh()
+
+    assert cache.etag.startswith('local-')
+    assert cache.resolver().resolve_one('paris', 'paris') == ('paris', 'île-de-france')
+
+
+if __name__ == '__main__':
+    test_normalize_cities_parity()
+    test_region_resolver_parity()
+    test_region_reference_cache_revalidation()
+    test_region_reference_cache_local_fallback()
+    print('SUCCESS')
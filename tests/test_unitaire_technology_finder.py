@@ -0,0 +1,88 @@
+import random
+import re
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python_scripts'))
+
+import pandas as pd
+
+import techno_matching
+from techno_matching import build_alias_map, build_technology_finder, create_extraction_pool, extract_technos_parallel
+
+
+# Listes représentatives de la table lists (avec quelques cas limites : préfixes communs, caractères spéciaux, doublons)
+techno_list = ['python', 'pyspark', 'spark', 'powerbi', 'power', 'tableau', 'snowflake', 'databricks',
+               'airflow', 'kubernetes', 'docker', 'terraform', 'bigquery', 'postgresql', 'mysql', 'sql',
+               'c++', 'c#', '.net', 'node.js', 'scikit-learn', 'hadoop', 'kafka', 'spark', 'looker']
+mini_list = ['r', 'go', 'sas', 'aws', 'gcp', 'dbt', 'c', 'scala', 'java', 'c++', 'bi', 'ml', 'r', 'ms bi', '']
+
+
+# Implémentation d'origine de database_cleaning.py, utilisée comme référence
+def legacy_technology_finder(description):
+    technos = [i for i in techno_list if i in description.replace(' ', '')]
+
+    for mot in mini_list:
+        mot_escaped = re.escape(mot)
+        if re.findall(r'(?<!\S){}(?!\S)'.format(mot_escaped), description):
+            technos.append(mot)
+
+    technos = ', '.join(technos)
+    return technos
+
+
+def random_description(rng):
+    words = techno_list + mini_list + ['data', 'engineer', 'power bi', 'py spark', 'sq l', 'gog', 'rr',
+                                       '(aws)', 'aws,', 'ms bi', 'ms  bi', 'c++/java', 'équipe', 'cloud', 'mysq', 'snow flake']
+    separators = [' ', ' ', ' ', '  ', '\t', '\n', '\xa0', '\u2003', '', '/', ', ']
+    return ''.join(rng.choice(words) + rng.choice(separators) for _ in range(rng.randint(0, 60)))
+
+
+def check_technology_finder_parity():
+    rng = random.Random(42)
+    technology_finder = build_technology_finder(techno_list, mini_list)
+
+    descriptions = ['', ' ', 'python', 'pysparkling', 'power bi et tableau', 'sqlmysql', ' r go ',
+                    'c++ et c#, .net', 'nodejs node.js', 'ms bi', 'go\xa0aws', 'aws\u3000r'] + [random_description(rng) for _ in range(2000)]
+
+    for description in descriptions:
+        assert technology_finder(description) == legacy_technology_finder(description), description
+
+
+def test_technology_finder_parity():
+    check_technology_finder_parity()
+
+
+# Même contrôle sans pyahocorasick (recherche de sous-chaîne par techno)
+def test_technology_finder_parity_without_pyahocorasick():
+    automaton_module = techno_matching.ahocorasick
+    techno_matching.ahocorasick = None
+    try:
+        check_technology_finder_parity()
+    finally:
+        techno_matching.ahocorasick = automaton_module
+
+
+def test_extract_technos_parallel_keeps_order():
+    rng = random.Random(7)
+    techno_dict = {'Python': ['python'], 'Spark': ['spark', 'pyspark'], 'AWS': ['aws', '(aws)']}
+    descriptions = pd.Series([random_description(rng) for _ in range(500)], index=range(1000, 0, -2))
+
+    technology_finder, alias_map = build_technology_finder(techno_list, mini_list), build_alias_map(techno_dict)
+    serial = extract_technos_parallel(descriptions, technology_finder, alias_map)
+
+    # Le même pool sert pour plusieurs appels
+    with create_extraction_pool(techno_list, mini_list, techno_dict, workers=3) as pool:
+        parallel = extract_technos_parallel(descriptions, technology_finder, alias_map, pool, chunk_size=64)
+        parallel_again = extract_technos_parallel(descriptions, technology_finder, alias_map, pool, chunk_size=64)
+
+    assert parallel.index.equals(descriptions.index)
+    assert parallel.equals(serial)
+    assert parallel_again.equals(serial)
+
+
+if __name__ == '__main__':
+    test_technology_finder_parity()
+    test_technology_finder_parity_without_pyahocorasick()
+    test_extract_technos_parallel_keeps_order()
+    print('SUCCESS')
@@ -0,0 +1,36 @@
+import random
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'python_scripts'))
+
+import pandas as pd
+
+from techno_matching import build_technology_finder
+from token_index import TokenIndex, changed_technos
+from test_unitaire_technology_finder import techno_list, mini_list, random_description
+
+
+# Les annonces dont les technos changent doivent toutes faire partie des candidates retournées par l'index
+def test_candidates_cover_changed_jobs():
+    rng = random.Random(3)
+    descriptions = pd.Series([random_description(rng) for _ in range(300)], index=range(1, 301))
+
+    token_index = TokenIndex()
+    token_index.add(pd.Series(descriptions.index, index=descriptions.index), descriptions)
+
+    new_techno_list = [techno for techno in techno_list if techno != 'docker'] + ['flakedata', 'scalable']
+    new_mini_list = [mot for mot in mini_list if mot != 'aws'] + ['gog']
+    changed_techno, changed_mini = changed_technos((techno_list, mini_list, {}), (new_techno_list, new_mini_list, {}))
+    candidate_ids = set(token_index.candidates(changed_techno, changed_mini).tolist())
+
+    old_finder = build_technology_finder(techno_list, mini_list)
+    new_finder = build_technology_finder(new_techno_list, new_mini_list)
+    for job_id, description in descriptions.items():
+        if set(old_finder(description).split(', ')) != set(new_finder(description).split(', ')):
+            assert job_id in candidate_ids, description
+
+
+if __name__ == '__main__':
+    test_candidates_cover_changed_jobs()
+    print('SUCCESS')